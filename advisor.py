@@ -0,0 +1,185 @@
+""" Suggests moves for a player, by searching over the rules of the game.
+
+A move is at most one of `buy`, `inv` and `ret`, followed by at most one
+`att` or `sup`. The advisor plays a move on a copy of the game, runs the
+battle with whatever the other players have planned and moves the economy a
+round forward, and then looks further ahead the same way, assuming the other
+players do nothing more. Only the battles planned by players the player can
+reach through the battles matter to it, so the copy drops the others, and
+positions are told apart by the players that are left. Moves are taken back
+with the commands' own undo.
+The search deepens a round at a time until the time is up, and returns the
+best move of the deepest search it completed. A transposition table of the
+positions already valued, keyed by a hash of the game state, cuts off the
+many ways of reaching the same position, and puts the best move found for a
+position first when it is searched again a round deeper. """
+
+from timeit import default_timer as timer
+
+import commands
+import events
+import whatif
+
+# The (lockedRounds, rate) pairs the bank offers bonds at
+bondTerms = [(1, 2), (3, 5)]
+# Percent of the retracted gold paid as fee
+retractFee = 10
+# What a soldier is worth compared to a piece of gold
+soldierWorth = 0.5
+# Positions kept in the transposition table before it is cleared
+tableSize = 200000
+# Rounds to look ahead at most
+maxDepth = 20
+
+class OutOfTime(Exception):
+    pass
+
+def worth(game, p):
+    return game.gold[p] + game.bonds.total(p) + soldierWorth * game.soldiers[p]
+
+def reachable(game, p):
+    """ Returns the players p can get into a battle with, directly or
+        through the battles planned, who are the only ones p's moves can
+        change or be changed by """
+    adjacent = {}
+    for a, b in game.attackStack + game.supportStack:
+        adjacent.setdefault(a, []).append(b)
+        adjacent.setdefault(b, []).append(a)
+    found = set([p]) | set(game.links[p])
+    stack = list(found)
+    while stack:
+        for q in adjacent.get(stack.pop(), ()):
+            if q not in found:
+                found.add(q)
+                stack.append(q)
+    return sorted(found)
+
+def position(game, players):
+    """ Returns a hash of everything a move can change, when only players
+        can be affected by it """
+    return hash((tuple(game.gold[q] for q in players),
+                 tuple(game.soldiers[q] for q in players),
+                 tuple(tuple(sorted(game.bonds.of(q))) for q in players),
+                 game.bonds.round, game.inbattle,
+                 tuple(game.attackStack), tuple(game.supportStack)))
+
+def moves(game, p):
+    """ Returns the moves player p can make, as lists of command lines """
+    gold, bonds = game.gold[p], game.bonds.total(p)
+    economy = [[]]
+    for n in sorted(set([gold, gold // 2])):
+        if n > 0:
+            economy.append(["buy %d %d" % (p, n)])
+            for k, y in bondTerms:
+                economy.append(["inv %d %d %d %d" % (p, n, k, y)])
+    if bonds > 0:
+        economy.append(["ret %d %d %d" % (p, bonds, bonds * retractFee // 100)])
+    battle = [[]]
+    planned = [a for a, _ in game.attackStack + game.supportStack]
+    if p not in planned:
+        for q in sorted(game.links[p]):
+            if q != p:
+                battle.append(["att %d %d" % (p, q)])
+                battle.append(["sup %d %d" % (p, q)])
+    return [e + b for e in economy for b in battle]
+
+class Search(object):
+    """ Searches the moves of p on game, which should be a copy, as the
+        battles p can't take part in are dropped from it """
+    def __init__(self, game, p, deadline):
+        self.game = game
+        self.p = p
+        self.deadline = deadline
+        self.table = {} # (position, depth) -> (value, best move)
+        self.nodes = 0
+        self.players = reachable(game, p)
+        players = set(self.players)
+        game.attackStack = [(a, b) for a, b in game.attackStack if a in players]
+        game.supportStack = [(a, b) for a, b in game.supportStack if a in players]
+        # The best move so far of the search started last
+        self.rootDepth = None
+        self.partial = (None, None)
+
+    def play(self, lines):
+        """ Plays the lines and a round. Returns the commands run, or None if
+            one of the lines is against the rules. """
+        game, done = self.game, []
+        errors = []
+        game.events.subscribe(errors.append)
+        try:
+            for line in lines:
+                parts = line.split()
+                Cmd = commands.registry[parts[0]]
+                if parts[0] in ("att", "sup") and not game.inbattle:
+                    done.append(self.run(commands.NewBattleCommand))
+                done.append(self.run(Cmd, *commands.parseArgs(game, Cmd, parts[1:])))
+                if any(isinstance(e, events.ValidationError) for e in errors):
+                    self.takeBack(done)
+                    return None
+            if game.inbattle:
+                done.append(self.run(commands.RunBattleCommand))
+            done.append(self.run(commands.RunEconomyCommand))
+        finally:
+            game.events.unsubscribe(errors.append)
+        return done
+
+    def run(self, Cmd, *args):
+        inst = Cmd()
+        inst.run(self.game, *args)
+        return inst
+
+    def takeBack(self, done):
+        for inst in reversed(done):
+            inst.undo(self.game)
+
+    def value(self, depth):
+        """ Returns the best worth reachable in depth rounds, and the move
+            leading to it """
+        if depth == 0:
+            return worth(self.game, self.p), None
+        self.nodes += 1
+        key = (position(self.game, self.players), depth)
+        if key in self.table:
+            return self.table[key]
+        options = moves(self.game, self.p)
+        # Try the best move of a shallower search first
+        hint = self.table.get((key[0], depth-1), (None, None))[1]
+        if hint in options:
+            options.remove(hint)
+            options.insert(0, hint)
+        best = (None, None)
+        for move in options:
+            if timer() > self.deadline:
+                raise OutOfTime()
+            done = self.play(move)
+            if done is None:
+                continue
+            try:
+                value = self.value(depth-1)[0]
+            finally:
+                self.takeBack(done)
+            if best[0] is None or value > best[0]:
+                best = (value, move)
+                if depth == self.rootDepth:
+                    self.partial = best
+        if len(self.table) >= tableSize:
+            self.table.clear()
+        self.table[key] = best
+        return best
+
+def advise(game, p, budget=1.0):
+    """ Returns the best move found for player p within budget seconds, the
+        worth it leads to and how many rounds ahead it was searched """
+    deadline = timer() + budget
+    search = Search(whatif.fork(game, whatif.checkpoint(game)), p, deadline)
+    best, depth = ([], worth(game, p)), 0
+    try:
+        while depth < maxDepth:
+            search.rootDepth = depth + 1
+            value, move = search.value(depth + 1)
+            best, depth = (move or [], value), depth + 1
+    except OutOfTime:
+        # Without a finished search, the best move tried will have to do
+        if depth == 0 and search.partial[1] is not None:
+            best, depth = (search.partial[1], search.partial[0]), 1
+    return best[0], best[1], depth
@@ -0,0 +1,102 @@
+#!/bin/env python
+
+""" Runs commands from files, without anyone at the keyboard.
+
+Usage: batch.py [-k] [-v] [-c n] [file ...]
+
+The commands are read a line at a time from each file in turn, or from stdin
+if no files are given and for a file called -. Like main.py, the game is
+continued from main.backup, and the history, event log and replica are
+kept as main.py is set to. The journal is written every n commands with
+-c, and otherwise only when it is compacted and at the end of the batch,
+instead of after every command. Only errors are printed, with the file and
+line they come from, unless -v is given to print everything. The batch stops
+at the first failing command, unless -k is given to keep going. """
+
+import getopt, sys, traceback
+
+import main
+import events
+from journal import Journal
+
+class Errors(object):
+    """ Collects the errors emitted while a command runs """
+    kinds = (events.ValidationError, events.UnknownCommand)
+    def __init__(self):
+        self.messages = []
+    def __call__(self, event):
+        if isinstance(event, (events.ValidationError, events.UnknownCommand)):
+            self.messages.append(event.render())
+
+def run(game, journal, lines, name, keepGoing=False):
+    """ Runs the command lines of the file called name.
+        Returns the number of commands run, how many of them failed, and
+        whether the batch should stop. """
+    errors = Errors()
+    game.events.subscribe(errors)
+    ran = failed = 0
+    try:
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            ran += 1
+            del errors.messages[:]
+            try:
+                isdone = main.execute(game, journal, line)
+            except Exception:
+                errors.messages.append(traceback.format_exc().strip())
+                # The command may be half applied, so we store the state as is
+                problem = main.salvage(game, journal)
+                if problem:
+                    errors.messages.append(problem)
+                isdone = False
+            for message in errors.messages:
+                print >> sys.stderr, "%s:%d: %s" % (name, number, message)
+            if errors.messages:
+                failed += 1
+                if not keepGoing:
+                    return ran, failed, True
+            if isdone:
+                return ran, failed, True
+    finally:
+        game.events.unsubscribe(errors)
+    return ran, failed, False
+
+###############################################################################
+# Run
+
+if __name__ == "__main__":
+    try:
+        opts, paths = getopt.getopt(sys.argv[1:], "kvc:")
+    except getopt.GetoptError, e:
+        print >> sys.stderr, "Error: %s" % e
+        print >> sys.stderr, "Usage: batch.py [-k] [-v] [-c n] [file ...]"
+        sys.exit(2)
+    opts = dict(opts)
+    game = main.Game()
+    if "-v" in opts:
+        game.events.subscribe(events.Printer())
+    journal = Journal(main.backup, int(opts.get("-c", sys.maxint)),
+                      main.fsyncPolicy, main.compactEvery)
+    if main.restore and journal.restore(game, lambda cmd: main.execute(game, journal, cmd)):
+        print >> sys.stderr, "Info: Restored the game from %s" % main.backup
+    main.attach(game, main.backup)
+    total = errors = 0
+    for path in paths or ["-"]:
+        if path == "-":
+            ran, failed, stop = run(game, journal, sys.stdin, "<stdin>", "-k" in opts)
+        else:
+            f = open(path)
+            try:
+                ran, failed, stop = run(game, journal, f, path, "-k" in opts)
+            finally:
+                f.close()
+        total += ran
+        errors += failed
+        if stop:
+            break
+    journal.close(game)
+    main.detach(game)
+    print >> sys.stderr, "Info: Ran %d commands, %d failed" % (total, errors)
+    sys.exit(1 if errors else 0)
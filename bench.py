@@ -0,0 +1,135 @@
+#!/bin/env python
+
+""" Times the main commands on generated games of growing size.
+
+Usage: bench.py [players ...]
+
+Every size is measured in a fresh process, so the peak memory reported is
+that of the size alone. The results are appended to benchFile as one line
+of json per run, so runs before and after a change can be compared. """
+
+import json
+import os, sys, random, resource, shutil, tempfile, time
+import multiprocessing
+from timeit import default_timer as timer
+
+import main
+from journal import Journal
+
+benchFile = "benchResults.json"
+sizes = [10, 100, 1000]
+repeat = 5
+seed = 1
+
+###############################################################################
+# Generators
+
+def generateGame(rnd, players, degree=3, bondsPerPlayer=4):
+    """ Returns the commands setting up a game with a random symmetric map
+        and a random portfolio of bonds for every player """
+    links = [set() for p in range(players)]
+    for p in range(players):
+        for _ in range(degree // 2 + 1):
+            q = rnd.randrange(players)
+            if q != p:
+                links[p].add(q)
+                links[q].add(p)
+    cmds = ["sps %d" % players, "sma %s" % json.dumps([sorted(l) for l in links])]
+    for p in range(players):
+        cmds.append("sgo %d %d" % (p, rnd.randint(0, 1000)))
+        cmds.append("sss %d %d" % (p, rnd.randint(1, 500)))
+        bonds = [[rnd.randint(1, 500), rnd.randint(1, 10), rnd.choice([2, 5, 10, 20])]
+                 for _ in range(rnd.randint(0, 2*bondsPerPlayer))]
+        cmds.append("sbs %d %s" % (p, json.dumps(bonds)))
+    return cmds
+
+def generatePlan(rnd, players, chainLength=4):
+    """ Returns the commands planning a battle, where about a third of the
+        players attack, two fifths support someone, and the rest support
+        each other in chains closed back into loops """
+    cmds = ["nba"]
+    order = range(players)
+    rnd.shuffle(order)
+    looping = []
+    for p in order:
+        r = rnd.random()
+        if r < 0.3:
+            cmds.append("att %d %d" % (p, (p + rnd.randrange(1, players)) % players))
+        elif r < 0.7:
+            cmds.append("sup %d %d" % (p, rnd.randrange(players)))
+        else:
+            looping.append(p)
+    while looping:
+        chain = looping[:rnd.randint(2, chainLength)]
+        del looping[:len(chain)]
+        # The last of the chain supports the first, a lone player himself
+        for i, p in enumerate(chain):
+            cmds.append("sup %d %d" % (p, chain[(i+1) % len(chain)]))
+    return cmds
+
+###############################################################################
+# Measuring
+
+def best(game, journal, cmd):
+    """ Returns the best time of running cmd, and of undoing it """
+    times, undos = [], []
+    for _ in range(repeat):
+        t = timer()
+        main.execute(game, journal, cmd)
+        times.append(timer() - t)
+        t = timer()
+        main.execute(game, journal, "undo")
+        undos.append(timer() - t)
+    return min(times), min(undos)
+
+def measure(players):
+    rnd = random.Random(seed)
+    tmp = tempfile.mkdtemp()
+    try:
+        # No subscribers, so events are dropped
+        game = main.Game()
+        journal = Journal(os.path.join(tmp, "bench.cmds"), main.flushEvery,
+                          main.fsyncPolicy, main.compactEvery)
+        result = {"players": players}
+        t = timer()
+        for cmd in generateGame(rnd, players) + generatePlan(rnd, players):
+            main.execute(game, journal, cmd)
+        result["load"] = timer() - t
+        result["rba"], result["undo rba"] = best(game, journal, "rba")
+        result["rec"], result["undo rec"] = best(game, journal, "rec")
+        rich = max(range(players), key=game.bonds.total)
+        result["ret"], result["undo ret"] = best(game, journal,
+                "ret %d %d 0" % (rich, max(1, game.bonds.total(rich) // 2)))
+        times = []
+        for _ in range(repeat):
+            t = timer()
+            journal.compact(game)
+            times.append(timer() - t)
+        result["saveState"] = min(times)
+        result["peakMemoryKb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        journal.close(game)
+        return result
+    finally:
+        shutil.rmtree(tmp)
+
+###############################################################################
+# Run
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sizes = map(int, sys.argv[1:])
+    results = []
+    for players in sizes:
+        # A fresh process per size, so the peak memory is its own
+        pool = multiprocessing.Pool(1)
+        result = pool.apply(measure, (players,))
+        pool.close()
+        results.append(result)
+        print "%6d players:" % players, ", ".join("%s %.6fs" % (k, result[k])
+                for k in ("load", "rba", "undo rba", "rec", "undo rec",
+                          "ret", "undo ret", "saveState")),
+        print "peak %d kb" % result["peakMemoryKb"]
+    f = open(benchFile, "a")
+    print >> f, json.dumps({"time": time.time(), "seed": seed,
+                            "repeat": repeat, "results": results})
+    f.close()
@@ -0,0 +1,134 @@
+def interest(amount, rate):
+    """ The gold a bond of amount pays every round at rate percent """
+    return int(amount * rate/100.)
+
+def maturityOrder(bond):
+    """ Sorts bonds as stored in a book, the first to mature first """
+    player, amount, maturity, rate = bond
+    return (maturity, amount, rate)
+
+class BondBook(object):
+    """ The bonds of all players, indexed by player and by maturity.
+        Bonds are given and returned as tuples (player, amount, lockedRounds,
+        rate). Inside the book the lockedRounds are stored as the round the
+        bond matures, so moving to the next round doesn't touch the bonds
+        that stay locked. Equal bonds may be held several times, so each
+        player maps bonds to a count. The bonds given are locked from round
+        on. The players whose bonds change are added to touched, for those
+        who keep a copy of the totals to update. """
+
+    def __init__(self, bonds=(), round=0):
+        self.round = round
+        self.byPlayer = self._table()
+        self.byMaturity = self._table()
+        self.totals = self._table()
+        self.incomes = self._table()
+        self.groups = self._table() # (player, rate) -> (bonds, interest every round)
+        self.size = 0
+        self.touched = set()
+        for bond in bonds:
+            self.add(bond)
+
+    def _internal(self, bond):
+        player, amount, lockedRounds, rate = bond
+        return (player, amount, self.round + lockedRounds, rate)
+
+    def _external(self, bond):
+        player, amount, maturity, rate = bond
+        return (player, amount, maturity - self.round, rate)
+
+    def _table(self):
+        return {}
+
+    def _held(self, table, key):
+        """ Returns the bond counts in table[key], ready to be changed """
+        return table.setdefault(key, {})
+
+    def _count(self, table, key, bond, n):
+        held = self._held(table, key)
+        held[bond] = held.get(bond, 0) + n
+        if held[bond] == 0:
+            del held[bond]
+            if not held:
+                del table[key]
+
+    def _insert(self, bond, n):
+        player, amount, maturity, rate = bond
+        self._count(self.byPlayer, player, bond, n)
+        self._count(self.byMaturity, maturity, bond, n)
+        self.totals[player] = self.totals.get(player, 0) + n*amount
+        self.incomes[player] = self.incomes.get(player, 0) + n*interest(amount, rate)
+        count, y = self.groups.get((player, rate), (0, 0))
+        if count + n:
+            self.groups[(player, rate)] = (count + n, y + n*interest(amount, rate))
+        else:
+            del self.groups[(player, rate)]
+        self.size += n
+        self.touched.add(player)
+
+    def add(self, bond):
+        self._insert(self._internal(bond), 1)
+
+    def remove(self, bond):
+        """ Removes one copy of bond. Raises KeyError if it isn't held. """
+        bond = self._internal(bond)
+        if bond not in self.byPlayer.get(bond[0], ()):
+            raise KeyError(bond)
+        self._insert(bond, -1)
+
+    def of(self, p):
+        """ Returns the bonds held by player p, the first to mature first.
+            The order doesn't depend on how the book was built, so `ret`
+            sells the same bonds when a journal is replayed. """
+        bonds = []
+        held = self.byPlayer.get(p, {})
+        for bond in sorted(held.iterkeys(), key=maturityOrder):
+            bonds.extend([self._external(bond)]*held[bond])
+        return bonds
+
+    def total(self, p):
+        """ Returns the sum of the amounts of player p's bonds """
+        return self.totals.get(p, 0)
+
+    def income(self, p):
+        """ Returns the interest player p's bonds pay next round """
+        return self.incomes.get(p, 0)
+
+    def advance(self, rounds=1):
+        """ Moves the book the given number of rounds forward.
+            Returns the interest paid on the way, as a dict from (player,
+            rate) to gold, and the list of bonds released. Bonds keep paying
+            interest up to and including the round they are released in,
+            and bonds that weren't locked to begin with are never released.
+            Runs in time linear in the number of rounds, (player, rate)
+            pairs and released bonds. """
+        paid = dict((key, rounds*y) for key, (_, y) in self.groups.iteritems())
+        released = []
+        for maturity in xrange(self.round+1, self.round+rounds+1):
+            for bond, count in self.byMaturity.get(maturity, {}).items():
+                player, amount, _, rate = bond
+                # It stops paying interest after the round it is released
+                paid[(player, rate)] -= count * interest(amount, rate) \
+                                              * (self.round+rounds - maturity)
+                self._insert(bond, -count)
+                released.extend([bond]*count)
+        self.round += rounds
+        return paid, released
+
+    def rewind(self, rounds, released):
+        """ Undoes advance(rounds), which released the given bonds """
+        self.round -= rounds
+        for bond in released:
+            self._insert(bond, 1)
+
+    def __iter__(self):
+        for held in self.byPlayer.itervalues():
+            for bond, count in held.iteritems():
+                for _ in xrange(count):
+                    yield self._external(bond)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, bond):
+        return self._internal(bond) in self.byPlayer.get(bond[0], ())
@@ -0,0 +1,189 @@
+""" Optional numpy backed game state, for simulating games with many players.
+
+useArrays(game) turns the gold and soldiers of a game into int64 arrays and
+its bonds into a BondTable. The commands keep working on either kind of
+state, and use the helpers below to handle a whole team in one operation
+when the state is backed by arrays. The results are the same to the last
+gold piece, as the arrays use the same float rounding as the int() calls
+on plain lists. """
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import persistent
+from bondbook import interest, maturityOrder
+
+def isArray(values):
+    return numpy is not None and isinstance(values, numpy.ndarray)
+
+def useArrays(game):
+    if numpy is None:
+        raise ImportError("numpy is needed for array backed games")
+    game.gold = numpy.array(game.gold, numpy.int64)
+    game.soldiers = numpy.array(game.soldiers, numpy.int64)
+    game.bonds = BondTable(game.bonds, game.bonds.round)
+
+def resized(values, n):
+    """ Returns values padded with zeros to length n """
+    if isArray(values):
+        return numpy.concatenate([values, numpy.zeros(n-len(values), numpy.int64)])
+    values.extend([0]*(n-len(values)))
+    return values
+
+def filled(like, value, n):
+    """ Returns n copies of value, in the same kind of column as like """
+    if isArray(like):
+        return numpy.full(n, value, numpy.int64)
+    if isinstance(like, persistent.Vector):
+        return persistent.Vector([value]*n)
+    return [value]*n
+
+def get(values, indices):
+    if isArray(values):
+        return values[indices]
+    return [values[i] for i in indices]
+
+def put(values, indices, new):
+    if isArray(values):
+        values[indices] = new
+    else:
+        for i, value in zip(indices, new):
+            values[i] = value
+
+def scaled(values, team, factor):
+    """ Returns int(factor * values[p]) for every p in team """
+    if isArray(values):
+        return (factor * values[team]).astype(numpy.int64)
+    return [int(factor * values[p]) for p in team]
+
+def shares(values, team, total, n):
+    """ Returns int(values[p]/float(total) * n) for every p in team """
+    if isArray(values):
+        return (values[team] / float(total) * n).astype(numpy.int64)
+    return [int(values[p]/float(total) * n) for p in team]
+
+def subtracted(values, team, amounts):
+    """ Returns values[p] - amounts[i] for every i, p in enumerate(team) """
+    if isArray(values):
+        return values[team] - amounts
+    return [values[p] - n for p, n in zip(team, amounts)]
+
+class BondTable(object):
+    """ A BondBook storing the bonds as int64 columns, one row per bond.
+        Moving rounds forward is computed on whole columns, while looking up
+        the bonds of a single player scans the player column. """
+
+    fields = ("player", "amount", "maturity", "rate")
+
+    def __init__(self, bonds=(), round=0):
+        self.round = round
+        self.size = 0
+        self.columns = dict((f, numpy.zeros(16, numpy.int64)) for f in self.fields)
+        self.totals = {}
+        self.incomes = {}
+        self.touched = set()
+        for bond in bonds:
+            self.add(bond)
+
+    def _column(self, field):
+        return self.columns[field][:self.size]
+
+    def _append(self, bond):
+        if self.size == len(self.columns["player"]):
+            for f in self.fields:
+                self.columns[f] = numpy.concatenate(
+                        [self.columns[f], numpy.zeros(self.size, numpy.int64)])
+        for f, value in zip(self.fields, bond):
+            self.columns[f][self.size] = value
+        self.size += 1
+        self._count(bond, 1)
+
+    def _count(self, bond, n):
+        player, amount, _, rate = bond
+        self.totals[player] = self.totals.get(player, 0) + n*amount
+        self.incomes[player] = self.incomes.get(player, 0) + n*interest(amount, rate)
+        self.touched.add(player)
+
+    def _row(self, i):
+        return tuple(int(self.columns[f][i]) for f in self.fields)
+
+    def add(self, bond):
+        player, amount, lockedRounds, rate = bond
+        self._append((player, amount, self.round + lockedRounds, rate))
+
+    def remove(self, bond):
+        """ Removes one copy of bond. Raises KeyError if it isn't held. """
+        player, amount, lockedRounds, rate = bond
+        rows = numpy.flatnonzero((self._column("player") == player)
+                               & (self._column("amount") == amount)
+                               & (self._column("maturity") == self.round + lockedRounds)
+                               & (self._column("rate") == rate))
+        if not len(rows):
+            raise KeyError(bond)
+        # Move the last row into the hole
+        self.size -= 1
+        for f in self.fields:
+            self.columns[f][rows[0]] = self.columns[f][self.size]
+        self._count(bond, -1)
+
+    def of(self, p):
+        """ Returns the bonds held by player p, in the order of BondBook.of """
+        rows = [self._row(i) for i in numpy.flatnonzero(self._column("player") == p)]
+        return [self._external(bond) for bond in sorted(rows, key=maturityOrder)]
+
+    def _external(self, bond):
+        player, amount, maturity, rate = bond
+        return (player, amount, maturity - self.round, rate)
+
+    def total(self, p):
+        """ Returns the sum of the amounts of player p's bonds """
+        return self.totals.get(p, 0)
+
+    def income(self, p):
+        """ Returns the interest player p's bonds pay next round """
+        return self.incomes.get(p, 0)
+
+    def advance(self, rounds=1):
+        """ See BondBook.advance """
+        if not self.size:
+            self.round += rounds
+            return {}, []
+        player, amount, maturity, rate = map(self._column, self.fields)
+        releasing = (maturity > self.round) & (maturity <= self.round + rounds)
+        paidRounds = numpy.where(releasing, maturity - self.round, rounds)
+        pay = (amount * rate / 100.).astype(numpy.int64) * paidRounds
+        # Sum the pay of each (player, rate) group
+        groups, inverse = numpy.unique(numpy.column_stack([player, rate]),
+                                       axis=0, return_inverse=True)
+        sums = numpy.zeros(len(groups), numpy.int64)
+        numpy.add.at(sums, inverse, pay)
+        paid = dict(((int(p), int(r)), int(s)) for (p, r), s in zip(groups, sums))
+        # Release bonds
+        released = [self._row(i) for i in numpy.flatnonzero(releasing)]
+        keep = ~releasing
+        n = int(keep.sum())
+        for f in self.fields:
+            self.columns[f][:n] = self._column(f)[keep]
+        self.size = n
+        for bond in released:
+            self._count(bond, -1)
+        self.round += rounds
+        return paid, released
+
+    def rewind(self, rounds, released):
+        """ Undoes advance(rounds), which released the given bonds """
+        self.round -= rounds
+        for bond in released:
+            self._append(bond)
+
+    def __iter__(self):
+        for i in xrange(self.size):
+            yield self._external(self._row(i))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, bond):
+        return bond in self.of(bond[0])
@@ -1,11 +1,142 @@
-from copy import deepcopy
-import json
+import bisect, json
+import columns
+import events
+import advisor
+import whatif
+from gamemap import Map, readMap
+
+###############################################################################
+# Argument types
+#
+# Each takes the game and one raw string from the command line, and returns
+# the parsed value or raises ValueError with a message for the user.
+
+def integer(game, s):
+    try:
+        return int(s)
+    except ValueError:
+        raise ValueError("'%s' is not an integer" % s)
+
+def player(game, s):
+    p = integer(game, s)
+    if not 0 <= p < game.players:
+        raise ValueError("there is no player %d (players are 0 to %d)"
+                         % (p, game.players-1))
+    return p
+
+def text(game, s):
+    return s
+
+def jsonValue(game, s):
+    try:
+        return json.loads(s)
+    except ValueError:
+        raise ValueError("'%s' is not valid json" % s)
+
+def _isInt(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+def intLists(game, s):
+    """ A json list of lists of integers """
+    value = jsonValue(game, s)
+    if not isinstance(value, list) or not all(isinstance(l, list) and
+            all(_isInt(x) for x in l) for l in value):
+        raise ValueError("'%s' is not a list of lists of integers" % s)
+    return value
+
+def bondList(game, s):
+    """ A json list of [amount, lockedRounds, rate] triples of integers """
+    value = intLists(game, s)
+    if not all(len(bond) == 3 for bond in value):
+        raise ValueError("'%s' is not a list of [amount, lockedRounds, rate]" % s)
+    return value
+
+def error(game, message):
+    game.events.emit(events.ValidationError(message))
+
+###############################################################################
+# Commands
+
+class CommandType(type):
+    """ Gives every command class empty __slots__ unless it has its own, so
+        the commands kept for undo only hold their backup. """
+    def __new__(meta, name, bases, attrs):
+        attrs.setdefault("__slots__", ())
+        return type.__new__(meta, name, bases, attrs)
 
 class Command(object):
+    __metaclass__ = CommandType
+    __slots__ = ("backup",)
+    # The argument schema as a tuple of (name, type) pairs. A name starting
+    # with '*' takes the rest of the line, a name ending with '?' is optional.
+    args = ()
+    # Whether running the command line again gives the same result. If not,
+    # the journal stores the state it leads to instead of the line.
+    replayable = True
+    # Commands that don't change the game are neither kept for undo nor
+    # written to the journal.
+    readOnly = False
     def run(self, game, *a): pass
     def repr(self, game): pass
     def undo(self, game): pass
 
+class Delta(object):
+    """ A log of the changes a command made to the game, kept so that undo
+        can revert exactly those, rather than restoring a copy of the game. """
+    __slots__ = ("log", "before")
+    def __init__(self):
+        self.log = [] # (op, field, key, old)
+        self.before = {}
+    def set(self, game, field, i, value):
+        values = getattr(game, field)
+        self.log.append(("item", field, i, values[i]))
+        self.before.setdefault((field, i), values[i])
+        values[i] = value
+    def setMany(self, game, field, indices, new):
+        values = getattr(game, field)
+        old = columns.get(values, indices)
+        self.log.append(("items", field, indices, old))
+        for i, value in zip(indices, old):
+            self.before.setdefault((field, i), value)
+        columns.put(values, indices, new)
+    def add(self, game, field, i, n):
+        self.set(game, field, i, getattr(game, field)[i] + n)
+    def old(self, game, field, i):
+        """ Returns the value game.field[i] had before the command """
+        return self.before.get((field, i), getattr(game, field)[i])
+    def replace(self, game, field, value):
+        self.log.append(("attr", field, None, getattr(game, field)))
+        setattr(game, field, value)
+    def addBond(self, game, bond):
+        game.bonds.add(bond)
+        self.log.append(("add", "bonds", bond, None))
+    def removeBond(self, game, bond):
+        game.bonds.remove(bond)
+        self.log.append(("remove", "bonds", bond, None))
+    def advance(self, game, rounds):
+        paid, released = game.bonds.advance(rounds)
+        self.log.append(("advance", "bonds", rounds, released))
+        return paid, released
+    def __getstate__(self):
+        # The old values are only looked up while the command runs
+        return self.log
+    def __setstate__(self, log):
+        self.log, self.before = log, {}
+    def revert(self, game):
+        for op, field, key, old in reversed(self.log):
+            if op == "item":
+                getattr(game, field)[key] = old
+            elif op == "items":
+                columns.put(getattr(game, field), key, old)
+            elif op == "attr":
+                setattr(game, field, old)
+            elif op == "advance":
+                getattr(game, field).rewind(key, old)
+            elif op == "add":
+                getattr(game, field).remove(key)
+            else:
+                getattr(game, field).add(key)
+
 ###############################################################################
 # General commands
 
@@ -15,7 +146,13 @@ class UndoCommand(Command):
     def run(self, game):
         transparent = True
         while transparent:
-            transparent = game.undoStack.pop().undo(game)
+            inst = game.undoStack.pop()
+            if game.profiler is None:
+                transparent = inst.undo(game)
+            else:
+                transparent = game.profiler.call("undo " + inst.sig, inst.undo, game)
+            if not transparent:
+                game.events.emit(events.Undone(inst.sig))
     def repr(self, game):
         pass
     def undo(self, game):
@@ -24,42 +161,136 @@ class UndoCommand(Command):
 class ExitCommand(Command):
     sig = "quit"
     doc = "Exits the game, but you won't do that, right?"
+    readOnly = True
     def run(self, game):
         return True
 
 class PrintReportCommand(Command):
     sig = "print"
     doc = "Prints a report of the current game state. If called with an argument p, it prints only the state of that player."
-    def run(self, game, *args):
-        if len(args) == 1:
-            players = [int(args[0])]
+    args = (("p?", player),)
+    readOnly = True
+    def run(self, game, p=None):
+        if not game.events.wants(events.Report):
+            return
+        if p is not None:
+            players = [p]
         else: players = range(game.players)
-        print "=========="
-        print "The map has the connections:", game.links
-        print "Economy:"
+        lines = ["=========="]
+        lines.append("The map has the connections: %s" % (game.links,))
+        lines.append("Economy:")
         for p in players:
-            print "    Player %d has %d gold and %d soldiers" % (p, game.gold[p], game.soldiers[p])
-            print "    His/her bonds are %r" % [bond[1:] for bond in game.bonds if bond[0]==p]
+            lines.append("    Player %d has %d gold and %d soldiers" % (p, game.gold[p], game.soldiers[p]))
+            lines.append("    His/her bonds are %r" % [bond[1:] for bond in game.bonds.of(p)])
         if game.inbattle:
-            print "Currently on the supportStack:"
-            print "    " + " ".join(map(repr,game.supportStack))
-            print "Currently on the attackStack:"
-            print "    " + " ".join(map(repr,game.attackStack))
+            lines.append("Currently on the supportStack:")
+            lines.append("    " + " ".join(map(repr,game.supportStack)))
+            lines.append("Currently on the attackStack:")
+            lines.append("    " + " ".join(map(repr,game.attackStack)))
         else:
-            print "No battles are currently being planned"
-        print "=========="
+            lines.append("No battles are currently being planned")
+        lines.append("==========")
+        game.events.emit(events.Report("\n".join(lines)))
     def undo(self, game):
         return True
 
 class HelpCommand(Command):
     sig = "help"
     doc = "Prints this help section"
+    readOnly = True
     def run(self, game):
-        print "=========="
-        print "The help you need - from people who love you,"
-        for Cmd in Command.__subclasses__():
-            print "    `%s`: \t%s" % (Cmd.sig, Cmd.doc)
-        print "=========="
+        if not game.events.wants(events.Report):
+            return
+        lines = ["==========", "The help you need - from people who love you,"]
+        for Cmd in commandList:
+            lines.append("    `%s`: \t%s" % (usage(Cmd), Cmd.doc))
+        lines.append("==========")
+        game.events.emit(events.Report("\n".join(lines)))
+
+class StandingsCommand(Command):
+    sig = "standings"
+    doc = "Prints the players from the richest to the poorest, counting both their gold and their bonds."
+    readOnly = True
+    def run(self, game):
+        if not game.events.wants(events.Report):
+            return
+        worth = [game.gold[p] + game.bonds.total(p) for p in range(game.players)]
+        lines = ["==========", "Standings:"]
+        for rank, p in enumerate(sorted(range(game.players), key=lambda p: -worth[p])):
+            lines.append("    %d. Player %d is worth %d: %d gold and %d in bonds paying %d next round"
+                         % (rank+1, p, worth[p], game.gold[p], game.bonds.total(p),
+                            game.bonds.income(p)))
+        lines.append("==========")
+        game.events.emit(events.Report("\n".join(lines)))
+
+class AdviseCommand(Command):
+    sig = "adv"
+    doc = "Suggests a move for player p, looking as many rounds ahead as " +\
+          "it can in ms milliseconds, by default 1000."
+    args = (("p", player), ("ms?", integer))
+    readOnly = True
+    def run(self, game, p, ms=1000):
+        if ms <= 0:
+            error(game, "ms must be > 0.")
+            return
+        if not game.events.wants(events.Report):
+            return
+        move, value, depth = advisor.advise(game, p, ms / 1000.)
+        game.events.emit(events.Report(
+                "Advice for player %d: %s (looked %d rounds ahead, worth %.1f)"
+                % (p, "; ".join(move) or "do nothing", depth, value)))
+
+class HistoryCommand(Command):
+    sig = "his"
+    doc = "Prints the gold, soldiers and bonds of player p after each round. " +\
+          "If called with first and last, only those rounds are printed."
+    args = (("p", player), ("first?", integer), ("last?", integer))
+    readOnly = True
+    def run(self, game, p, first=0, last=None):
+        if game.history is None:
+            error(game, "The history is off, set `history = True` in main.py to record it.")
+            return
+        if not game.events.wants(events.Report):
+            return
+        # The rounds only grow, as undoing a round drops it from the history
+        rounds = game.history.rounds()
+        start = bisect.bisect_left(rounds, first)
+        stop = len(rounds) if last is None else bisect.bisect_right(rounds, last)
+        series = [game.history.series(field, p, start, stop)
+                  for field in ("gold", "soldiers", "bonds")]
+        lines = ["==========", "History of player %d:" % p]
+        for round, gold, soldiers, bonds in zip(rounds[start:stop], *series):
+            if gold is not None:
+                lines.append("    Round %d: %d gold, %d soldiers and %d in bonds"
+                             % (round, gold, soldiers, bonds))
+        lines.append("==========")
+        game.events.emit(events.Report("\n".join(lines)))
+
+class StatsCommand(Command):
+    sig = "stats"
+    doc = "Prints how often each command was run and how long it took. " +\
+          "If called with a path, the numbers are written there as json."
+    args = (("*path?", text),)
+    readOnly = True
+    def run(self, game, path=None):
+        if game.profiler is None:
+            error(game, "Profiling is off, set `profile = True` in main.py to turn it on.")
+        elif path is None:
+            if not game.events.wants(events.Report):
+                return
+            lines = ["=========="] + game.profiler.report() + ["=========="]
+            game.events.emit(events.Report("\n".join(lines)))
+        else:
+            try:
+                f = open(path, "w")
+                try:
+                    json.dump(game.profiler.asDict(), f, indent=1, sort_keys=True)
+                finally:
+                    f.close()
+            except IOError, e:
+                error(game, "Couldn't write the stats to %s: %s" % (path, e))
+    def undo(self, game):
+        return True
 
 ###############################################################################
 # Initial commands
@@ -67,15 +298,17 @@ class HelpCommand(Command):
 class SetPlayersCommand(Command):
     sig = "sps"
     doc = "Sets the number of players in the game to a specific number."
+    args = (("n", integer),)
     def run(self, game, n):
         self.backup = game.players
-        game.players = int(n)
-        while len(game.gold) < game.players:
-            game.gold.append(0)
-        while len(game.soldiers) < game.players:
-            game.soldiers.append(0)
-        while len(game.links) < game.players:
-            game.links.append([])
+        game.players = n
+        if len(game.gold) < game.players:
+            game.gold = columns.resized(game.gold, game.players)
+        if len(game.soldiers) < game.players:
+            game.soldiers = columns.resized(game.soldiers, game.players)
+        # Maps are never changed in place, so forked games can share them
+        if len(game.links) < game.players:
+            game.links = game.links.grown(game.players)
     def repr(self, game):
         return "%s %s" % (self.sig, game.players)
     def undo(self, game):
@@ -86,20 +319,9 @@ class SetMapCommand(Command):
     doc = "Sets a new map. Example: `sma [[1],[0]]` creates a map where " +\
           "country 0 is connected to country 1 and country 1 is connected " +\
           "to country 0. All contries always have sea access."
-    def run(self, game, *a):
-        links = json.loads(" ".join(a))
-        if len(links) < game.players:
-            print "Error: each %d players must have a (possibly empty) sublist." % game.players
-            self.backup = None
-        else:
-            for p, cons in enumerate(links):
-                for q in cons:
-                    if not p in links[q]:
-                        print "Error: Links (for player %d) must be symetrical." % p
-                        self.backup = None
-                        return
-            self.backup = game.links
-            game.links = links
+    args = (("*links", intLists),)
+    def run(self, game, links):
+        changeMap(self, game, Map(links))
     def repr(self, game):
         return "%s %r" % (self.sig, game.links)
     def undo(self, game):
@@ -107,32 +329,77 @@ class SetMapCommand(Command):
             return True
         game.links = self.backup
 
+class LoadMapCommand(Command):
+    sig = "lma"
+    doc = "Loads a new map from a file. The file either has the map as " +\
+          "json, like for `sma`, or one line `p q` for each pair of " +\
+          "connected countries p and q."
+    args = (("*path", text),)
+    replayable = False
+    def run(self, game, path):
+        try:
+            f = open(path)
+            try:
+                links = readMap(f)
+            finally:
+                f.close()
+        except (IOError, ValueError, TypeError), e:
+            error(game, "Couldn't load a map from %s: %s" % (path, e))
+            self.backup = None
+            return
+        # Countries without connections don't appear in edge lists
+        while len(links) < game.players:
+            links.append([])
+        changeMap(self, game, links)
+    def undo(self, game):
+        if not self.backup:
+            return True
+        game.links = self.backup
+
+def changeMap(cmd, game, links):
+    if len(links) < game.players:
+        error(game, "each %d players must have a (possibly empty) sublist." % game.players)
+        cmd.backup = None
+        return
+    problem = links.problem()
+    if problem:
+        error(game, problem)
+        cmd.backup = None
+        return
+    cmd.backup = game.links
+    game.links = links
+
 ###############################################################################
 # Economy commands
 
 class RunEconomyCommand(Command):
     sig = "rec"
-    doc = "Make a step in the economy, sending returns from bonds."
-    def run(self, game):
-        self.backup = deepcopy((game.gold, game.bonds))
-        newList = set()
-        for player, amount, lockedRounds, rate in game.bonds:
-            game.gold[player] += int(amount * rate/100.)
-            print "Info: Player %d got %d earnings from a bond." % (player, int(amount * rate/100.))
-            if lockedRounds == 1:
-                game.gold[player] += amount
-                print "Info: Released a bond of value %d to player %d." % (amount, player)
-            else:
-                newList.add((player, amount, lockedRounds-1, rate))
-        game.bonds = newList
+    doc = "Make a step in the economy, sending returns from bonds. If called with an argument n, it makes n steps at once."
+    args = (("n?", integer),)
+    def run(self, game, n=1):
+        if n <= 0:
+            error(game, "n must be > 0.")
+            self.backup = None
+            return
+        self.backup = delta = Delta()
+        paid, released = delta.advance(game, n)
+        for (player, rate), amount in sorted(paid.iteritems()):
+            delta.add(game, "gold", player, amount)
+            game.events.emit(events.BondPaid(player, amount, rate))
+        for player, amount, _, _ in released:
+            delta.add(game, "gold", player, amount)
+            game.events.emit(events.BondReleased(player, amount))
+        game.events.emit(events.RoundEnded(self.sig))
     def undo(self, game):
-        game.gold, game.bonds = self.backup
+        if not self.backup:
+            return True
+        self.backup.revert(game)
 
 class SetGoldCommand(Command):
     sig = "sgo"
     doc = "Sets the gold of a player to a specific integer value"
+    args = (("a", player), ("n", integer))
     def run(self, game, a, n):
-        a, n = int(a), int(n)
         self.backup = (a, game.gold[a])
         game.gold[a] = n
     def repr(self, game):
@@ -144,35 +411,35 @@ class SetGoldCommand(Command):
 class SetAllGoldCommand(Command):
     sig = "sag"
     doc = "Set the gold of every player to n"
+    args = (("n", integer),)
     def run(self, game, n):
-        self.backup = deepcopy(game.gold)
-        game.gold = [int(n)]*game.players
+        self.backup = game.gold
+        game.gold = columns.filled(game.gold, n, game.players)
     def undo(self, game):
         game.gold = self.backup
 
 class SetBondsCommand(Command):
     sig = "sbs"
-    doc = "Sets the current bond holdings of a player as a list [[amount, rate, lockedRounds]], where rate is a the roundly return rate in percent"
-    def run(self, game, a, *bonds):
-        a = int(a)
-        self.backup = deepcopy(game.bonds)
-        bonds = json.loads(" ".join(bonds))
-        bonds = set((a,)+tuple(bond) for bond in bonds)
-        game.bonds.update(bonds)
+    doc = "Sets the current bond holdings of a player as a list [[amount, lockedRounds, rate]], where rate is a the roundly return rate in percent"
+    args = (("a", player), ("*bonds", bondList))
+    def run(self, game, a, bonds):
+        self.backup = delta = Delta()
+        for bond in bonds:
+            delta.addBond(game, (a,)+tuple(bond))
     def repr(self, game):
         lines = []
         for i in range(game.players):
             lines.append("%s %d %r" % (self.sig, i,
-                    [list(bond[1:]) for bond in game.bonds if bond[0] == i]))
+                    [list(bond[1:]) for bond in game.bonds.of(i)]))
         return "\n".join(lines)
     def undo(self, game):
-        game.bonds = self.backup
+        self.backup.revert(game)
 
 class SetSoldiersCommand(Command):
     sig = "sss"
     doc = "Sets the number of soldiers for a player to a specific integer value"
+    args = (("a", player), ("n", integer))
     def run(self, game, a, n):
-        a, n = int(a), int(n)
         self.backup = (a, game.soldiers[a])
         game.soldiers[a] = n
     def repr(self, game):
@@ -184,13 +451,13 @@ class SetSoldiersCommand(Command):
 class TransferCommand(Command):
     sig = "tra"
     doc = "Transfers from player a to b, n gold"
+    args = (("a", player), ("b", player), ("n", integer))
     def run(self, game, a, b, n):
-        a, b, n = int(a), int(b), int(n)
         if n <= 0:
-            print "Error: Gold transfers must be positive"
+            error(game, "Gold transfers must be positive")
             self.backup = None
         elif game.gold[a] < n:
-            print "Error: Player %d has only %d gold" % (a, game.gold[a])
+            error(game, "Player %d has only %d gold" % (a, game.gold[a]))
             self.backup = None
         else:
             game.gold[a] -= n
@@ -206,13 +473,13 @@ class TransferCommand(Command):
 class BuyCommand(Command):
     sig = "buy"
     doc = "Convenient method for letting player a buy n soldiers for price 1."
+    args = (("a", player), ("n", integer))
     def run(self, game, a, n):
-        a, n = int(a), int(n)
         if n < 0:
-            print "Error: n must by >= 0. Soldiers can't be sold."
+            error(game, "n must by >= 0. Soldiers can't be sold.")
             self.backup = None
         elif game.gold[a] < n:
-            print "Error: Player %d has only %d gold" % (a, game.gold[a])
+            error(game, "Player %d has only %d gold" % (a, game.gold[a]))
             self.backup = None
         else:
             game.gold[a] -= n
@@ -228,65 +495,61 @@ class BuyCommand(Command):
 class InvestCommand(Command):
     sig = "inv"
     doc = "Invest for player a, n gold for k rounds at rate y."
+    args = (("a", player), ("n", integer), ("k", integer), ("y", integer))
     def run(self, game, a, n, k, y):
-        a, n, k, y = int(a), int(n), int(k), int(y)
         if n <= 0:
-            print "Error: n must be > 0. To retract, use `ret`."
+            error(game, "n must be > 0. To retract, use `ret`.")
             self.backup = None
         elif game.gold[a] < n:
-            print "Error: Player %d has only %d gold" % (a, game.gold[a])
+            error(game, "Player %d has only %d gold" % (a, game.gold[a]))
             self.backup = None
         else:
             game.gold[a] -= n
             bond = (a, n, k, y)
             game.bonds.add(bond)
             self.backup = bond
-            print "Info: Created bond of %d for player %d at rate %d%%. Locked for %d rounds." \
-                  % (bond[1], bond[0], bond[3], bond[2])
+            game.events.emit(events.BondCreated(*bond))
     def undo(self, game):
         if not self.backup:
             return True
         game.bonds.remove(self.backup)
+        game.gold[self.backup[0]] += self.backup[1]
 
 class RetractCommand(Command):
     sig = "ret"
     doc = "Retract from player a's bonds, n gold for fee of k, as this breaks the round bound."
+    args = (("a", player), ("n", integer), ("k", integer))
     def run(self, game, a, n, k):
-        a, n, k = int(a), int(n), int(k)
         if n <= 0:
-            print "Error: n must be > 0. To invest use `inv`."
+            error(game, "n must be > 0. To invest use `inv`.")
             self.backup = None
             return
-        available = sum(bond[1] for bond in game.bonds if bond[0]==a)
+        available = game.bonds.total(a)
         if available < n:
-            print "Error: Player %d doesn't have %d gold available. (Has %d)" \
-                    % (a, n, available)
+            error(game, "Player %d doesn't have %d gold available. (Has %d)"
+                        % (a, n, available))
             self.backup = None
         elif game.gold[a] + available < k:
-            print "Error: Player %d doesn't have enough money to pay the fee. (Has %d)" \
-                    % (a, game.gold[a]+available)
+            error(game, "Player %d doesn't have enough money to pay the fee. (Has %d)"
+                        % (a, game.gold[a]+available))
             self.backup = None
         else:
-            self.backup = (deepcopy(game.bonds), a, game.gold[a])
+            self.backup = delta = Delta()
             taken = 0
-            deleted = set()
-            for bond in game.bonds:
-                if bond[0] == a:
-                    taken += bond[1]
-                    deleted.add(bond)
+            deleted = []
+            for bond in game.bonds.of(a):
+                taken += bond[1]
+                deleted.append(bond)
                 if taken >= n and game.gold[a]+taken >= k:
                     break
-            game.bonds -= deleted
-            game.gold[a] += taken
-            game.gold[a] -= k
-            print "Took out %d gold, gave %d to the bank. Account now has %d gold." \
-                    % (taken, k, game.gold[a])
+            for bond in deleted:
+                delta.removeBond(game, bond)
+            delta.add(game, "gold", a, taken - k)
+            game.events.emit(events.BondRetracted(a, taken, k, game.gold[a]))
     def undo(self, game):
         if not self.backup:
             return True
-        bouds, a, gold = self.backup
-        game.bonds = bouds
-        game.gold[a] = gold
+        self.backup.revert(game)
 
 ###############################################################################
 # Battle commands
@@ -294,9 +557,10 @@ class RetractCommand(Command):
 class SetWaterDiePercentage(Command):
     sig = "swd"
     doc = "Sets the percentage of soldiers that die in an overseas battle."
+    args = (("p", integer),)
     def run(self, game, p):
         self.backup = game.waterDiePercentage
-        game.waterDiePercentage = int(p)
+        game.waterDiePercentage = p
     def repr(self, game):
         return "%s %d" % (self.sig, game.waterDiePercentage)
     def undo(self, game):
@@ -307,36 +571,37 @@ class NewBattleCommand(Command):
     doc = "Starts a new battle session"
     def run(self, game):
         if game.supportStack or game.attackStack or game.inbattle:
-            print "Warning: You already had a battle going." +\
-                  " If you wanted it, undo this and use `rba` to execute it."
+            game.events.emit(events.GameWarning("You already had a battle going." +\
+                  " If you wanted it, undo this and use `rba` to execute it."))
             self.backup = None
         else:
-            self.backup = deepcopy((game.supportStack, game.attackStack, game.inbattle))
-            game.inbattle = True
-            del game.supportStack[:]
-            del game.attackStack[:]
+            # The stacks are empty when not in a battle, so only the flag changes
+            self.backup = delta = Delta()
+            delta.replace(game, "inbattle", True)
     def repr(self, game):
         if game.inbattle:
             return self.sig
     def undo(self, game):
-        game.supportStack, game.attackStack, game.inbattle = self.backup
+        if not self.backup:
+            return True
+        self.backup.revert(game)
 
 class SupportCommand(Command):
     sig = "sup"
     doc = "Player a chooses to support player b during the next battle."
+    args = (("a", player), ("b", player))
     def run(self, game, a, b):
-        a, b = int(a), int(b)
         if not game.inbattle:
-            print "Error: Not currently in a battle."
+            error(game, "Not currently in a battle.")
             self.backup = None
         elif a in (p for p,q in game.attackStack):
-            print "Error: Player %d is already on the attackStack." % a
+            error(game, "Player %d is already on the attackStack." % a)
             self.backup = None
         elif a in (p for p,q in game.supportStack):
-            print "Error: Player %d is already on the supportStack." % a
+            error(game, "Player %d is already on the supportStack." % a)
             self.backup = None
         elif game.soldiers[a] == 0:
-            print "Error: Player %d has no soldiers." % a
+            error(game, "Player %d has no soldiers." % a)
             self.backup = None
         else:
             game.supportStack.append((a,b))
@@ -351,19 +616,19 @@ class SupportCommand(Command):
 class AttackCommand(Command):
     sig = "att"
     doc = "Player a chooses to attack player b during the next battle."
+    args = (("a", player), ("b", player))
     def run(self, game, a, b):
-        a, b = int(a), int(b)
         if not game.inbattle:
-            print "Error: Not currently in a battle."
+            error(game, "Not currently in a battle.")
             self.backup = None
         elif a in (p for p,q in game.attackStack):
-            print "Error: Player %d is already on the attackStack." % a
+            error(game, "Player %d is already on the attackStack." % a)
             self.backup = None
         elif a in (p for p,q in game.supportStack):
-            print "Error: Player %d is already on the supportStack." % a
+            error(game, "Player %d is already on the supportStack." % a)
             self.backup = None
         elif game.soldiers[a] == 0:
-            print "Error: Player %d has no soldiers." % a
+            error(game, "Player %d has no soldiers." % a)
             self.backup = None
         else:
             game.attackStack.append((a,b))
@@ -375,94 +640,113 @@ class AttackCommand(Command):
             return True
         game.attackStack.remove(self.backup)
 
-def supportDfs(game, src, dst):
-    """ Returns true if src supports dst, directly or indirectly """
-    cache = set()
-    while src != dst:
-        if src in cache:
-            return False
-        cache.add(src)
-        for a,b in game.supportStack:
-            if a == src:
-                src = b
-                break
-    return True
+def supportBackers(game):
+    """ Returns a dict from each player to the players supporting them directly.
+        Every player supports at most one other, so following the support
+        from a player leads to a player supporting nobody or into a loop. """
+    backers = {}
+    for a,b in game.supportStack:
+        backers.setdefault(b, []).append(a)
+    return backers
+
+def supporters(backers, roots, exclude=()):
+    """ Returns the set of players supporting any of roots, directly or
+        indirectly, including the roots themselves but none in exclude. """
+    found = set(p for p in roots if p not in exclude)
+    stack = list(found)
+    while stack:
+        for p in backers.get(stack.pop(), ()):
+            if p not in found and p not in exclude:
+                found.add(p)
+                stack.append(p)
+    return found
 
-def moveGold(game, oldgold, fromTeam, toTeam):
+def moveGold(game, delta, fromTeam, toTeam):
     taken = 0
     # Remove
     for p in fromTeam:
-        # Take gold
-        take = min(oldgold[p],game.gold[p]) // 2
+        # Take gold, but no more than half of what they had before the battle
+        take = min(delta.old(game, "gold", p), game.gold[p]) // 2
         taken += take
-        game.gold[p] -= take
+        delta.add(game, "gold", p, -take)
         # Take bonds
-        new = set()
-        for player, amount, locked, rate in game.bonds:
-            if player == p:
-                new.add((player, amount-(amount//2), locked, rate))
-                taken += amount//2
-        game.bonds = set(bond for bond in game.bonds if bond[0] != p)
-        game.bonds.update(new)
+        for bond in game.bonds.of(p):
+            player, amount, locked, rate = bond
+            taken += amount//2
+            delta.removeBond(game, bond)
+            delta.addBond(game, (player, amount-(amount//2), locked, rate))
     # Give
     for p in toTeam:
-        game.gold[p] += taken // len(toTeam)
+        delta.add(game, "gold", p, taken // len(toTeam))
     # The rest to the attacker
-    game.gold[toTeam[0]] += taken % len(toTeam)
-    print "Info: The winning team stole %d in gold and bonds" % taken
+    delta.add(game, "gold", toTeam[0], taken % len(toTeam))
+    game.events.emit(events.GoldStolen(toTeam, fromTeam, taken))
 
-def takeSoldiers(game, team, n):
+def takeSoldiers(game, delta, team, n):
     total = sum(game.soldiers[p] for p in team)
     if total == 0:
         return
-    remainder = n
-    for p in team:
-        died = int(game.soldiers[p]/float(total) * n)
-        game.soldiers[p] -= died
-        remainder -= died
-    # The remainder by rotation
-    while remainder > 0:
-        for p in team:
-            if remainder > 0 and game.soldiers[p] > 0:
-                game.soldiers[p] -= 1
+    died = columns.shares(game.soldiers, team, total, n)
+    left = columns.subtracted(game.soldiers, team, died)
+    remainder = n - sum(died)
+    if remainder > 0:
+        # The deaths lost to rounding down go to the largest remainders,
+        # the first in the team on ties
+        order = sorted(range(len(team)), key = lambda i:
+                       (died[i] - game.soldiers[team[i]]/float(total) * n, i))
+        for i in order:
+            if remainder == 0:
+                break
+            if left[i] > 0:
+                left[i] -= 1
                 remainder -= 1
+    delta.setMany(game, "soldiers", team, left)
 
 class RunBattleCommand(Command):
     sig = "rba"
     doc = "Run the current battle session"
     def run(self, game):
         if not game.inbattle:
-            print "Error: Not currently in a battle, use `nba` to start one."
+            error(game, "Not currently in a battle, use `nba` to start one.")
             self.backup = None
             return
-        self.backup = (deepcopy(game.gold), deepcopy(game.soldiers),
-                       deepcopy(game.attackStack), deepcopy(game.supportStack),
-                       deepcopy(game.bonds))
-        oldgold = deepcopy(game.gold)
-        # Init groups
-        battles = []
+        self.backup = delta = Delta()
+        clock = game.profiler and game.profiler.clock(self.sig)
+        # Init groups, one for each defender. The first attacker leads,
+        # except that later attackers next to the defender go before it,
+        # the latest first.
+        defenders = []
+        groups = {}
         for a,b in game.attackStack:
-            # Check merge
-            for p,q in battles:
-                if b == q[0]:
-                    if q[0] in game.links[a]:
-                        p.insert(0, a)
-                    else:
-                        p.append(a)
-                    break
+            if b not in groups:
+                groups[b] = ([], [a])
+                defenders.append(b)
+            elif b in game.links[a]:
+                groups[b][0].append(a)
             else:
-                battles.append(([a],[b]))
+                groups[b][1].append(a)
+        battles = []
+        for b in defenders:
+            front, back = groups[b]
+            battles.append((front[::-1] + back, [b]))
+        if clock: clock("grouping")
         # Add supporters
-        for p in range(game.players):
-            for atts,defs in battles:
-                # Notice it is important that we check support for the defender
-                # first, as there may be love/hate loops
-                if supportDfs(game, p, defs[0]):
-                    if p != defs[0]:
-                        defs.append(p)
-                elif any(supportDfs(game, p, at) for at in atts):
-                    if p not in atts:
-                        atts.append(p)
+        backers = supportBackers(game)
+        joins = [[] for p in range(game.players)]
+        for atts,defs in battles:
+            # Notice it is important that we find support for the defender
+            # first, as there may be love/hate loops
+            defending = supporters(backers, defs)
+            attacking = supporters(backers, atts, exclude=defending)
+            for p in defending.difference(defs):
+                joins[p].append(defs)
+            for p in attacking.difference(atts):
+                joins[p].append(atts)
+        # Supporters join in the order of their number
+        for p, teams in enumerate(joins):
+            for team in teams:
+                team.append(p)
+        if clock: clock("support")
         # Sort battles by biggest army
         battles.sort(key = lambda (atts,defs): -game.soldiers[atts[0]])
         # Run battles
@@ -470,43 +754,103 @@ class RunBattleCommand(Command):
             # Kill water attacking soldiers
             if defs[0] not in game.links[atts[0]]:
                 before = sum(game.soldiers[p] for p in atts)
-                for p in atts:
-                    game.soldiers[p] = int((1-1/100.*game.waterDiePercentage) * game.soldiers[p])
+                delta.setMany(game, "soldiers", atts, columns.scaled(
+                        game.soldiers, atts, 1-1/100.*game.waterDiePercentage))
                 after = sum(game.soldiers[p] for p in atts)
                 if before-after > 0:
-                    print "Info: Team %r lost %d soldiers for attacking over water" % (atts,before-after)
+                    game.events.emit(events.WaterLoss(atts, before-after))
             # Check armies
             aArmy = sum(game.soldiers[p] for p in atts)
             if aArmy == 0:
-                print "Info: Team %r no longer has soldiers and retreat form attacking %r." % (atts, defs)
+                game.events.emit(events.Retreat(atts, defs))
+                if clock: clock("combat")
                 continue
             dArmy = sum(game.soldiers[p] for p in defs)
             # Assign deads
             deads = min(aArmy, dArmy)
-            takeSoldiers(game, atts, deads)
-            takeSoldiers(game, defs, deads)
+            takeSoldiers(game, delta, atts, deads)
+            takeSoldiers(game, delta, defs, deads)
             if aArmy > dArmy:
-                print "%r attacked %r and won" % (atts, defs)
+                outcome = "won"
             elif aArmy == dArmy:
-                print "%r drew %r" % (atts, defs)
+                outcome = "drew"
             else:
-                print "%r attacked %r, but lost" % (atts, defs)
-            print "%d soldiers died from each team." % (deads,),
-            if deads > 0:
-                print "They will be forever missed."
-            else: print
+                outcome = "lost"
+            game.events.emit(events.BattleResult(atts, defs, outcome))
+            game.events.emit(events.Casualties(deads))
+            if clock: clock("combat")
             # Assign gold
             if aArmy > dArmy:
-                moveGold(game, oldgold, defs, atts)
+                moveGold(game, delta, defs, atts)
             elif dArmy > aArmy:
-                moveGold(game, oldgold, atts, defs)
+                moveGold(game, delta, atts, defs)
+            if clock: clock("gold")
         # Clear stuff
-        game.inbattle = False
-        del game.attackStack[:]
-        del game.supportStack[:]
+        delta.replace(game, "inbattle", False)
+        delta.replace(game, "attackStack", [])
+        delta.replace(game, "supportStack", [])
+        game.events.emit(events.RoundEnded(self.sig))
     def undo(self, game):
         if not self.backup:
             return True
-        game.gold, game.soldiers, game.attackStack, game.supportStack, game.bonds = self.backup
-        game.inbattle = True
+        self.backup.revert(game)
 
+class WhatIfCommand(Command):
+    sig = "wif"
+    doc = "Shows what would happen in the battle with each of some " +\
+          "alternative plans, without changing the game. The plans are " +\
+          "given as json, e.g. [[\"att 0 1\"], [\"att 0 2\", \"sup 1 0\"]]."
+    args = (("*plans", jsonValue),)
+    readOnly = True
+    def run(self, game, plans):
+        if not isinstance(plans, list) or not all(isinstance(plan, list) and
+                all(isinstance(line, basestring) for line in plan) for plan in plans):
+            error(game, "The plans must be a list of lists of command lines.")
+            return
+        if not game.events.wants(events.Report):
+            return
+        lines = ["==========", "What if:"]
+        for i, result in enumerate(whatif.evaluate(game, plans)):
+            lines.append("    Plan %d: %s" % (i, "; ".join(result["plan"])))
+            for message in result["errors"]:
+                lines.append("        Error: %s" % message)
+            lines.append("        %d battles, %d soldiers died, %d gold stolen, won by %s"
+                    % (result["battles"], result["casualties"], result["gold"],
+                       result["winners"]))
+        lines.append("==========")
+        game.events.emit(events.Report("\n".join(lines)))
+
+
+###############################################################################
+# Registry
+
+# All commands in the order they are defined, which is also the order their
+# `repr` lines must be replayed in.
+commandList = Command.__subclasses__()
+registry = dict((Cmd.sig, Cmd) for Cmd in commandList)
+
+def usage(Cmd):
+    return " ".join([Cmd.sig] + [name for name, _ in Cmd.args])
+
+def parseArgs(game, Cmd, parts):
+    """ Converts the raw arguments of a command line according to the
+        commands argument schema. Raises ValueError if they don't fit. """
+    parts = list(parts)
+    values = []
+    for name, kind in Cmd.args:
+        if name.startswith("*") and parts:
+            raw, parts = " ".join(parts), []
+        elif parts:
+            raw = parts.pop(0)
+        elif name.endswith("?"):
+            break
+        else:
+            raise ValueError("Missing argument %s. Usage: `%s`"
+                             % (name.strip("*?"), usage(Cmd)))
+        try:
+            values.append(kind(game, raw))
+        except ValueError, e:
+            raise ValueError("Bad argument %s: %s" % (name.strip("*?"), e))
+    if parts:
+        raise ValueError("Too many arguments. Usage: `%s`" % usage(Cmd))
+    return values
@@ -0,0 +1,151 @@
+""" The things that happen in a game, as typed events.
+
+Commands emit events on game.events instead of printing. Subscribers decide
+what to do with them: a Printer renders them as text, JsonLines writes them
+to a file, and with no subscribers at all they are simply dropped. Commands
+check that an event is wanted before they spend time putting it together. """
+
+import json
+import sys
+
+class Event(object):
+    """ Something that happened in a game.
+        Each kind of event lists its fields, which are given positionally,
+        and how it is rendered as text, or None if it isn't shown. """
+    fields = ()
+    text = ""
+    def __init__(self, *values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+    def render(self):
+        if self.text is None:
+            return None
+        return self.text % self.__dict__
+    def asDict(self):
+        d = dict((name, getattr(self, name)) for name in self.fields)
+        d["event"] = self.__class__.__name__
+        return d
+
+###############################################################################
+# Events
+
+class UnknownCommand(Event):
+    fields = ("name",)
+    text = "Unknown command: '%(name)s'"
+
+class ValidationError(Event):
+    fields = ("message",)
+    text = "Error: %(message)s"
+
+class GameWarning(Event):
+    fields = ("message",)
+    text = "Warning: %(message)s"
+
+class Report(Event):
+    fields = ("text",)
+    def render(self):
+        return self.text
+
+class BondCreated(Event):
+    fields = ("player", "amount", "lockedRounds", "rate")
+    text = "Info: Created bond of %(amount)d for player %(player)d at rate %(rate)d%%. Locked for %(lockedRounds)d rounds."
+
+class BondRetracted(Event):
+    fields = ("player", "amount", "fee", "gold")
+    text = "Took out %(amount)d gold, gave %(fee)d to the bank. Account now has %(gold)d gold."
+
+class BondPaid(Event):
+    fields = ("player", "amount", "rate")
+    text = "Info: Player %(player)d got %(amount)d earnings from bonds at rate %(rate)d%%."
+
+class BondReleased(Event):
+    fields = ("player", "amount")
+    text = "Info: Released a bond of value %(amount)d to player %(player)d."
+
+class WaterLoss(Event):
+    fields = ("team", "soldiers")
+    text = "Info: Team %(team)r lost %(soldiers)d soldiers for attacking over water"
+
+class Retreat(Event):
+    fields = ("attackers", "defenders")
+    text = "Info: Team %(attackers)r no longer has soldiers and retreat form attacking %(defenders)r."
+
+class BattleResult(Event):
+    fields = ("attackers", "defenders", "outcome") # outcome is won, drew or lost
+    texts = {"won": "%(attackers)r attacked %(defenders)r and won",
+             "drew": "%(attackers)r drew %(defenders)r",
+             "lost": "%(attackers)r attacked %(defenders)r, but lost"}
+    def render(self):
+        return self.texts[self.outcome] % self.__dict__
+
+class Casualties(Event):
+    fields = ("soldiers",)
+    def render(self):
+        if self.soldiers > 0:
+            return "%d soldiers died from each team. They will be forever missed." % self.soldiers
+        return "%d soldiers died from each team." % self.soldiers
+
+class GoldStolen(Event):
+    fields = ("winners", "losers", "amount")
+    text = "Info: The winning team stole %(amount)d in gold and bonds"
+
+class RoundEnded(Event):
+    fields = ("command",) # rec or rba
+    text = None
+
+class Undone(Event):
+    fields = ("command",)
+    text = None
+
+###############################################################################
+# Subscribers
+
+class EventBus(object):
+    def __init__(self):
+        self.subscribers = []
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+    def emit(self, event):
+        for subscriber in self.subscribers:
+            subscriber(event)
+    def wants(self, kind):
+        """ Returns whether any subscriber takes events of kind. Subscribers
+            that only take some kinds of events list them as their kinds. """
+        for subscriber in self.subscribers:
+            kinds = getattr(subscriber, "kinds", None)
+            if kinds is None or issubclass(kind, kinds):
+                return True
+        return False
+
+class Printer(object):
+    """ Prints events as text, by default to whatever sys.stdout is when
+        the event happens. """
+    def __init__(self, f=None):
+        self.f = f
+    def __call__(self, event):
+        text = event.render()
+        if text is not None:
+            print >> (self.f or sys.stdout), text
+
+class JsonLines(object):
+    """ Appends events to a file as json, one per line, writing them in
+        batches of batchSize. """
+    def __init__(self, path, batchSize=100):
+        self.f = open(path, "a")
+        self.batchSize = batchSize
+        self.buffer = []
+    def __call__(self, event):
+        # numpy integers from array backed games are written as plain ints
+        self.buffer.append(json.dumps(event.asDict(), default=int))
+        if len(self.buffer) >= self.batchSize:
+            self.flush()
+    def flush(self):
+        if self.buffer:
+            self.f.write("\n".join(self.buffer) + "\n")
+            del self.buffer[:]
+        self.f.flush()
+    def close(self):
+        self.flush()
+        self.f.close()
@@ -0,0 +1,79 @@
+import json
+
+class Map(object):
+    """ Which countries are connected by land, as a set of neighbours for
+        each player, so checking a connection takes constant time.
+        It prints as the list of sorted neighbour lists `sma` takes. """
+
+    def __init__(self, links=()):
+        self.neighbours = [set(cons) for cons in links]
+
+    def __getitem__(self, p):
+        return self.neighbours[p]
+
+    def __len__(self):
+        return len(self.neighbours)
+
+    def __iter__(self):
+        return iter(self.neighbours)
+
+    def append(self, cons):
+        self.neighbours.append(set(cons))
+
+    def grown(self, n):
+        """ Returns a copy of the map with n players, sharing the neighbours
+            of the players it has """
+        other = Map()
+        other.neighbours = self.neighbours + [set() for _ in xrange(n - len(self))]
+        return other
+
+    def connect(self, p, q):
+        while len(self.neighbours) <= max(p, q):
+            self.neighbours.append(set())
+        self.neighbours[p].add(q)
+        self.neighbours[q].add(p)
+
+    def asLists(self):
+        return [sorted(cons) for cons in self.neighbours]
+
+    def __repr__(self):
+        return repr(self.asLists())
+
+    def problem(self):
+        """ Returns a description of what is wrong with the map, or None.
+            Runs in time linear in the number of links. """
+        n = len(self.neighbours)
+        for p, cons in enumerate(self.neighbours):
+            for q in cons:
+                if not isinstance(q, (int, long)) or not 0 <= q < n:
+                    return "Links (for player %d) must be to players 0 to %d." % (p, n-1)
+                if p not in self.neighbours[q]:
+                    return "Links (for player %d) must be symetrical." % p
+        return None
+
+def readMap(f):
+    """ Reads a map from a file, either as json in the format `sma` takes or
+        as an edge list with one pair of connected players per line. Edge
+        lists are read a line at a time, so only the map is kept in memory.
+        Raises ValueError on bad input. """
+    line = f.readline()
+    number = 1
+    while line and not line.strip():
+        line = f.readline()
+        number += 1
+    if line.lstrip().startswith("["):
+        return Map(json.loads(line + f.read()))
+    links = Map()
+    while line:
+        parts = line.split("#")[0].split()
+        if parts:
+            try:
+                p, q = map(int, parts)
+            except ValueError:
+                raise ValueError("Line %d must be two player numbers" % number)
+            if p < 0 or q < 0:
+                raise ValueError("Line %d has a negative player number" % number)
+            links.connect(p, q)
+        line = f.readline()
+        number += 1
+    return links
@@ -0,0 +1,125 @@
+""" A record of the economy after every round, for charts and replays.
+
+A History subscribes to the events of a game. Every time `rec` or `rba` ends
+a round it appends the gold, soldiers and bond total of every player to its
+file, and undoing the round cuts them off again. Nothing is recorded while
+a journal is replayed, as the rounds replayed are in the file already.
+
+The file is a sequence of frames. Each is a header with the kind of round,
+the round the bonds are in after it and the number of players, followed by the three columns as little endian
+64 bit integers. Opening a history only reads the frame headers, and
+queries read the file through a memory map, touching only the values they
+ask for. """
+
+import mmap, os, struct
+
+import events
+
+roundKinds = ("rec", "rba")
+fields = ("gold", "soldiers", "bonds")
+header = struct.Struct("<qqq") # kind, round, players
+
+class History(object):
+    kinds = (events.RoundEnded, events.Undone)
+
+    def __init__(self, path, game):
+        self.game = game
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self.f = open(path, "r+b")
+        self.map = None
+        self.offsets = []
+        self.f.seek(0, 2)
+        size = self.f.tell()
+        offset = 0
+        while offset + header.size <= size:
+            self.f.seek(offset)
+            kind, round, n = header.unpack(self.f.read(header.size))
+            end = offset + header.size + 8*len(fields)*n
+            if end > size:
+                break
+            self.offsets.append(offset)
+            offset = end
+        # Drop a frame that was cut off by a crash
+        self.end = offset
+        self.f.truncate(self.end)
+
+    def __call__(self, event):
+        if isinstance(event, events.RoundEnded):
+            self.append(event.command)
+        elif isinstance(event, events.Undone) and event.command in roundKinds \
+                and self.offsets:
+            self.pop()
+
+    def _unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def _view(self):
+        if self.map is None:
+            self.map = mmap.mmap(self.f.fileno(), self.end, access=mmap.ACCESS_READ)
+        return self.map
+
+    def append(self, kind):
+        game = self.game
+        players = range(game.players)
+        values = [game.gold[p] for p in players] + \
+                 [game.soldiers[p] for p in players] + \
+                 [game.bonds.total(p) for p in players]
+        self._unmap()
+        self.f.seek(self.end)
+        self.f.write(header.pack(roundKinds.index(kind), game.bonds.round,
+                                 game.players))
+        self.f.write(struct.pack("<%dq" % len(values), *map(int, values)))
+        self.f.flush()
+        self.offsets.append(self.end)
+        self.end = self.f.tell()
+
+    def pop(self):
+        self._unmap()
+        self.end = self.offsets.pop()
+        self.f.truncate(self.end)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def frame(self, i):
+        """ Returns the kind of round i, the round the bonds were in after it,
+            and a dict from each field to the values of every player then """
+        view = self._view()
+        kind, round, n = header.unpack_from(view, self.offsets[i])
+        values = struct.unpack_from("<%dq" % (len(fields)*n), view,
+                                    self.offsets[i] + header.size)
+        return roundKinds[kind], round, dict((field, list(values[j*n:(j+1)*n]))
+                                 for j, field in enumerate(fields))
+
+    def series(self, field, p, start=0, stop=None):
+        """ Returns the field of player p after each round from start up to
+            stop, with None for rounds before the player joined """
+        j = fields.index(field)
+        offsets = self.offsets[start:stop]
+        if not offsets:
+            return []
+        view = self._view()
+        values = []
+        for offset in offsets:
+            kind, round, n = header.unpack_from(view, offset)
+            if p < n:
+                values.append(struct.unpack_from("<q", view,
+                        offset + header.size + 8*(j*n + p))[0])
+            else:
+                values.append(None)
+        return values
+
+    def rounds(self):
+        """ Returns the round of the bonds after each round recorded, which
+            repeats for battles as they leave the bonds where they are """
+        if not self.offsets:
+            return []
+        view = self._view()
+        return [header.unpack_from(view, offset)[1] for offset in self.offsets]
+
+    def close(self):
+        self._unmap()
+        self.f.close()
@@ -0,0 +1,169 @@
+import os, re
+import commands
+import snapshot
+
+# When to fsync the journal file:
+#   "flush"   - after every batch of commands is written
+#   "compact" - only when the journal is compacted
+#   "never"   - leave it to the operating system
+fsyncPolicies = ("flush", "compact", "never")
+
+def writeState(game, f):
+    """ Writes the full game state as the commands that recreate it """
+    for Cmd in commands.commandList:
+        line = Cmd().repr(game)
+        if line:
+            print >> f, line
+
+class Journal(object):
+    """ An append-only log of the command lines applied to a game.
+        The file starts with a comment giving the generation of the journal,
+        then the state at the last compaction, written by the commands
+        `repr` methods, followed by every command given since. Replaying it
+        from the top recreates the current game.
+        Every compaction also writes a binary checkpoint of the state, which
+        restore loads instead of replaying the snapshot. """
+
+    def __init__(self, path, flushEvery=1, fsync="never", compactEvery=1000):
+        if fsync not in fsyncPolicies:
+            raise ValueError("fsync must be one of %r" % (fsyncPolicies,))
+        self.path = path
+        self.checkpoint = os.path.splitext(path)[0] + ".snap"
+        self.flushEvery = flushEvery
+        self.fsync = fsync
+        self.compactEvery = compactEvery
+        self.f = None
+        self.buffer = []
+        self.count = 0
+        self.base = 0
+        self.generation = 0
+        self.restoring = False
+
+    def append(self, game, line, replayable=True):
+        """ Logs a command that has just been applied to the game. If the
+            line can't be replayed, the resulting state is logged instead. """
+        if self.restoring:
+            return
+        # An undo reaching past the last compaction can't be replayed, since
+        # the commands it undid are no longer in the file. When the journal
+        # isn't open yet, the snapshot already includes the command.
+        if self.f is None or len(game.undoStack) < self.base or not replayable:
+            self.compact(game)
+            return
+        self.buffer.append(line)
+        self.count += 1
+        if self.count >= self.compactEvery:
+            self.compact(game)
+        elif len(self.buffer) >= self.flushEvery:
+            self.flush()
+
+    def flush(self):
+        if self.f is None:
+            return
+        if self.buffer:
+            self.f.write("\n".join(self.buffer) + "\n")
+            del self.buffer[:]
+        self.f.flush()
+        if self.fsync == "flush":
+            os.fsync(self.f.fileno())
+
+    def _write(self, path, mode, write):
+        """ Writes what write(f) writes to a file next to path, and returns
+            its name. The file is removed if write fails. """
+        tmp = path + ".tmp"
+        f = open(tmp, mode)
+        try:
+            write(f)
+            f.flush()
+            if self.fsync != "never":
+                os.fsync(f.fileno())
+        except:
+            f.close()
+            os.remove(tmp)
+            raise
+        f.close()
+        return tmp
+
+    def compact(self, game):
+        """ Folds the journal back into a snapshot of the current state.
+            If the state can't be written, the journal and checkpoint are
+            left as they were, and the error is raised. """
+        offset = []
+        generation = self.generation + 1
+        def writeJournal(f):
+            print >> f, "# generation %d" % generation
+            writeState(game, f)
+            offset.append(f.tell())
+        journal = self._write(self.path, "w", writeJournal)
+        try:
+            checkpoint = self._write(self.checkpoint, "wb", lambda f:
+                    snapshot.write(game, f, generation, offset[0]))
+        except:
+            os.remove(journal)
+            raise
+        # If we crash between the two, the generations don't match and the
+        # journal is replayed without the checkpoint
+        os.rename(journal, self.path)
+        os.rename(checkpoint, self.checkpoint)
+        self.generation = generation
+        if self.f is not None:
+            self.f.close()
+        self.f = open(self.path, "a")
+        del self.buffer[:]
+        self.count = 0
+        self.base = len(game.undoStack)
+
+    def restore(self, game, run):
+        """ Recreates the game saved in the journal, using run(line) to
+            apply commands. When the checkpoint belongs to the journal, it
+            is loaded and only the commands logged after it are replayed.
+            Returns False if there was no journal to restore. """
+        if not os.path.exists(self.path):
+            return False
+        f = open(self.path)
+        match = re.match(r"# generation (\d+)$", f.readline().strip())
+        generation = match and int(match.group(1)) or 0
+        try:
+            cf = open(self.checkpoint, "rb")
+            try:
+                checkpoint = snapshot.read(cf)
+            finally:
+                cf.close()
+        except (IOError, snapshot.SnapshotError):
+            checkpoint = None
+        if checkpoint and checkpoint[0] == generation and generation > 0:
+            _, offset, state = checkpoint
+            snapshot.apply(game, state)
+            f.seek(offset)
+        else:
+            f.seek(0)
+        self.generation = generation
+        # Nothing that happens while replaying is news
+        subscribers, game.events.subscribers = game.events.subscribers, []
+        self.restoring = True
+        try:
+            for line in f:
+                if line.strip():
+                    run(line.strip())
+        finally:
+            self.restoring = False
+            game.events.subscribers = subscribers
+            f.close()
+        self.compact(game)
+        return True
+
+    def close(self, game):
+        self.compact(game)
+        self.f.close()
+        self.f = None
+
+class NullJournal(object):
+    """ Stands in for the journal of a game that isn't saved """
+    def append(self, game, line, replayable=True):
+        pass
+    def flush(self):
+        pass
+    def compact(self, game):
+        pass
+    def close(self, game):
+        pass
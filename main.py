@@ -1,52 +1,176 @@
 #!/bin/env python
 
-import sys
+import os, sys, traceback
 import commands
+import columns
+import events
+import persistent
+import profiler
+from journal import Journal
+from history import History
+from replica import Replica
+from bondbook import BondBook
+from gamemap import Map
+from undolog import UndoLog
 
 backup = "gameBackup.cmds"
+# Commands written per flush, see journal.py for the fsync policies, and
+# commands logged before the journal is folded back into a snapshot.
+flushEvery = 1
+fsyncPolicy = "never"
+compactEvery = 1000
+# Continue the game in the backup on startup, from its latest checkpoint
+restore = True
+# Keep gold, soldiers and bonds in numpy arrays, see columns.py
+arrayState = False
+# Keep them in persistent tries instead, so games fork cheaply, see persistent.py
+persistentState = False
+# Don't print what happens in the game, and optionally log it as json lines
+quiet = False
+eventLog = None
+# Count and time commands for the `stats` command, see profiler.py
+profile = False
+# Commands kept in memory for undo, older ones are spilled to disk
+undoDepth = 1000
+# Record the economy after every round next to the backup, see history.py
+history = False
+# Publish the state after every command for viewer.py, to a file named after
+# the game in this directory, e.g. /dev/shm. See replica.py.
+replicaDir = None
 
 class Game:
-    players = 0
-    
-    links = []
-    gold = []
-    bonds = set() # (list of [player, amount, lockedRounds, rate])
-    soldiers = []
-    
-    waterDiePercentage = 10
-    
-    inbattle = False
-    attackStack = []
-    supportStack = []
-    
-    undoStack = []
+    def __init__(self):
+        self.players = 0
+        
+        self.links = Map()
+        self.gold = []
+        self.bonds = BondBook() # of (player, amount, lockedRounds, rate)
+        self.soldiers = []
+        
+        self.waterDiePercentage = 10
+        
+        self.inbattle = False
+        self.attackStack = []
+        self.supportStack = []
+        
+        self.undoStack = UndoLog(undoDepth)
+        self.history = None
+        self.replica = None
+        self.events = events.EventBus()
+        self.profiler = profiler.Profiler() if profile else None
+        if arrayState:
+            columns.useArrays(self)
+        if persistentState:
+            persistent.usePersistent(self)
 game = Game()
+if not quiet:
+    game.events.subscribe(events.Printer())
+# Shared by every game of the process, as server.py runs many
+if eventLog:
+    eventLogger = events.JsonLines(eventLog)
+journal = Journal(backup, flushEvery, fsyncPolicy, compactEvery)
+
+def replicaPath(journalPath):
+    """ Returns where the replica of the game journaled to journalPath is """
+    name = os.path.splitext(os.path.basename(journalPath))[0]
+    return os.path.join(replicaDir, name + ".state")
+
+def attach(game, journalPath):
+    """ Gives the game journaled to journalPath the event log, history and
+        replica asked for above. Call it once the game is restored. """
+    if eventLog:
+        game.events.subscribe(eventLogger)
+    if history:
+        game.history = History(os.path.splitext(journalPath)[0] + ".hist", game)
+        game.events.subscribe(game.history)
+    if replicaDir:
+        game.replica = Replica(replicaPath(journalPath))
+        game.replica.publish(game)
+
+def detach(game):
+    """ Closes what attach opened for game """
+    if game.history is not None:
+        game.history.close()
+    if game.replica is not None:
+        game.replica.close()
+    if eventLog:
+        eventLogger.flush()
 
 ###############################################################################
 # Commands
 
 def runCmd(cmd):
+    return execute(game, journal, cmd)
+
+def execute(game, journal, cmd):
+    """ Runs a command line against a game, logging it to its journal.
+        Returns True if the command ends the session. """
     parts = cmd.split()
-    for Cmd in commands.Command.__subclasses__():
-        if Cmd.sig == parts[0]:
-            inst = Cmd()
-            game.undoStack.append(inst)
-            return inst.run(game, *parts[1:])
+    if not parts or parts[0].startswith("#"):
+        return False
+    Cmd = commands.registry.get(parts[0])
+    if Cmd is None:
+        game.events.emit(events.UnknownCommand(parts[0]))
+        return False
+    try:
+        args = commands.parseArgs(game, Cmd, parts[1:])
+    except ValueError, e:
+        commands.error(game, str(e))
+        return False
+    inst = Cmd()
+    if not Cmd.readOnly:
+        game.undoStack.append(inst)
+    if game.profiler is None:
+        isdone = inst.run(game, *args)
+    else:
+        isdone = game.profiler.call(Cmd.sig, inst.run, game, *args)
+    if Cmd.readOnly:
+        return isdone
+    if game.replica is not None:
+        if game.profiler is None:
+            game.replica.publish(game)
+        else:
+            game.profiler.call("replica", game.replica.publish, game)
+    if isdone:
+        return isdone
+    if game.profiler is None:
+        journal.append(game, " ".join(parts), Cmd.replayable)
     else:
-        print "Unknown command: '%s'" % parts[0]
-    return False
+        game.profiler.call("journal", journal.append, game, " ".join(parts),
+                           Cmd.replayable)
+    return isdone
 
-def saveState():
-    f = open(backup, "w")
-    for Cmd in commands.Command.__subclasses__():
-        line = Cmd().repr(game)
-        if line:
-            print >> f, line
+def salvage(game, journal):
+    """ Stores the state as it is after a command failed partway, as its
+        line can't be replayed. Returns what went wrong if that fails too,
+        and the journal then keeps the last state it could store. """
+    try:
+        journal.compact(game)
+    except Exception, e:
+        return "Couldn't save the game, the backup keeps the state before " +\
+               "the failed command (%s: %s)" % (e.__class__.__name__, e)
+    return None
+
+def runSafely(game, journal, cmd):
+    """ Runs a command line like execute, but prints the error of a command
+        that fails instead of raising it """
+    try:
+        return execute(game, journal, cmd)
+    except:
+        traceback.print_exc(file=sys.stdout)
+        # The command may be half applied, so we store the state as is
+        problem = salvage(game, journal)
+        if problem:
+            print "Error: %s" % problem
+        return False
 
 ###############################################################################
 # Run
 
 if __name__ == "__main__":
+    if restore and journal.restore(game, runCmd):
+        print "Info: Restored the game from %s" % backup
+    attach(game, backup)
     while True:
         try:
             cmd = raw_input("% ").strip()
@@ -54,15 +178,13 @@ if __name__ == "__main__":
             break
         if not cmd:
             continue
-        try:
-            isdone = runCmd(cmd)
-        except:
-            import sys, traceback
-            traceback.print_exc()
-            isdone = False
+        isdone = runSafely(game, journal, cmd)
         if isdone:
             break
-        saveState()
+    journal.close(game)
+    detach(game)
+    if eventLog:
+        eventLogger.close()
     
     print "Well played!"
 
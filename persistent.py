@@ -0,0 +1,346 @@
+""" Persistent game state, for forking games in constant time.
+
+usePersistent(game) keeps the gold and soldiers of a game in Vectors and its
+bonds in a PersistentBondBook built from Dicts. Both are tries of nodes
+with 32 slots, and every node remembers its owner. A container changes the
+nodes it owns in place and copies the path to the change otherwise. Forking
+gives the copy and the original a new owner each, so they share all nodes
+until one of them changes something, and then only the path to the change
+is copied. Comparing two forks skips the nodes they still share. So forking
+and comparing take time in the number of changes, not the size of the game,
+and the commands run on the containers as if they were lists and dicts. """
+
+import copy
+
+import events
+from bondbook import BondBook
+from undolog import UndoLog
+
+bits = 5
+width = 1 << bits
+mask = width - 1
+hashMask = (1 << 64) - 1
+
+def isPersistent(game):
+    return isinstance(game.gold, Vector)
+
+def usePersistent(game):
+    if not isinstance(game.gold, list):
+        raise ValueError("only games kept in lists can be made persistent")
+    game.gold = Vector(game.gold)
+    game.soldiers = Vector(game.soldiers)
+    game.bonds = PersistentBondBook(game.bonds, game.bonds.round)
+
+def fork(game):
+    """ Returns a copy of a persistent game, with no subscribers or anything
+        to undo. The map is shared, as commands replace it rather than
+        change it. The battle stacks are copied, as they are never longer
+        than the moves planned since the last battle. """
+    other = copy.copy(game)
+    other.gold = game.gold.fork()
+    other.soldiers = game.soldiers.fork()
+    other.bonds = game.bonds.fork()
+    other.attackStack = list(game.attackStack)
+    other.supportStack = list(game.supportStack)
+    other.events = events.EventBus()
+    other.undoStack = UndoLog()
+    other.profiler = None
+    other.replica = None
+    return other
+
+def changes(game, other):
+    """ Returns the players whose gold, soldiers or bonds differ between two
+        forks of a game """
+    return {"gold": sorted(game.gold.diff(other.gold)),
+            "soldiers": sorted(game.soldiers.diff(other.soldiers)),
+            "bonds": sorted(game.bonds.byPlayer.diff(other.bonds.byPlayer))}
+
+class Trie(object):
+    """ The nodes of a Vector or Dict are lists of width slots followed by
+        their owner """
+
+    def _node(self):
+        return [None]*width + [self.owner]
+
+    def _writable(self, node):
+        if node[-1] is self.owner:
+            return node
+        node = node[:]
+        node[-1] = self.owner
+        return node
+
+    def fork(self, owner=None):
+        """ Returns a copy sharing all nodes. Neither owns them afterwards. """
+        other = copy.copy(self)
+        other.owner = owner or object()
+        self.owner = object()
+        return other
+
+    def __len__(self):
+        return self.size
+
+    def __eq__(self, other):
+        return isinstance(other, type(self)) and len(self) == len(other) \
+                and not any(True for _ in self.diff(other))
+
+    def __ne__(self, other):
+        return not self == other
+
+###############################################################################
+# Vector
+
+class Vector(Trie):
+    """ A list of values. The leaves of the trie hold the values in order,
+        and it grows a level when it is full. """
+
+    def __init__(self, values=()):
+        self.owner = object()
+        self.size = 0
+        self.shift = 0
+        self.root = self._node()
+        self.extend(values)
+
+    def _index(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("Vector index out of range")
+        return i
+
+    def _leafAt(self, i):
+        node = self.root
+        for shift in xrange(self.shift, 0, -bits):
+            node = node[(i >> shift) & mask]
+        return node
+
+    def _writableLeaf(self, i):
+        """ Returns the leaf for index i, owned by this vector """
+        self.root = node = self._writable(self.root)
+        for shift in xrange(self.shift, 0, -bits):
+            j = (i >> shift) & mask
+            child = self._writable(node[j]) if node[j] else self._node()
+            node[j] = child
+            node = child
+        return node
+
+    def __getitem__(self, i):
+        i = self._index(i)
+        return self._leafAt(i)[i & mask]
+
+    def __setitem__(self, i, value):
+        i = self._index(i)
+        self._writableLeaf(i)[i & mask] = value
+
+    def append(self, value):
+        if self.size == 1 << (self.shift + bits):
+            root = self._node()
+            root[0] = self.root
+            self.root = root
+            self.shift += bits
+        self._writableLeaf(self.size)[self.size & mask] = value
+        self.size += 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __iter__(self):
+        for i in xrange(0, self.size, width):
+            leaf = self._leafAt(i)
+            for j in xrange(min(width, self.size - i)):
+                yield leaf[j]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def diff(self, other):
+        """ Yields the indices where self and other differ """
+        if self.shift != other.shift:
+            for i in xrange(max(self.size, other.size)):
+                if i >= self.size or i >= other.size or self[i] != other[i]:
+                    yield i
+            return
+        stack = [(self.root, other.root, self.shift, 0)]
+        while stack:
+            a, b, shift, base = stack.pop()
+            if a is b:
+                continue
+            if shift == 0:
+                for j in xrange(width):
+                    if (a and a[j]) != (b and b[j]) and base+j < max(self.size, other.size):
+                        yield base + j
+                continue
+            for j in xrange(width):
+                stack.append((a and a[j], b and b[j], shift - bits,
+                              base + (j << shift)))
+
+###############################################################################
+# Dict
+
+def _items(slot):
+    """ Yields the (key, value) pairs under a slot of a Dict """
+    if slot is None:
+        return
+    if type(slot) is tuple:
+        for pair in slot[1]:
+            yield pair
+        return
+    for j in xrange(width):
+        for pair in _items(slot[j]):
+            yield pair
+
+class Dict(Trie):
+    """ A dict as a hash trie. Each slot is empty, a node, or a bucket of
+        the (key, value) pairs with one hash, stored as (hash, pairs). """
+
+    def __init__(self, items=(), owner=None):
+        self.owner = owner or object()
+        self.size = 0
+        self.root = self._node()
+        for key, value in items:
+            self[key] = value
+
+    def _bucket(self, key):
+        h = hash(key) & hashMask
+        node, shift = self.root, 0
+        while True:
+            slot = node[(h >> shift) & mask]
+            if type(slot) is not list:
+                return h, slot
+            node, shift = slot, shift + bits
+
+    def get(self, key, default=None):
+        h, slot = self._bucket(key)
+        if slot is not None and slot[0] == h:
+            for k, v in slot[1]:
+                if k == key:
+                    return v
+        return default
+
+    def __contains__(self, key):
+        h, slot = self._bucket(key)
+        return slot is not None and slot[0] == h and \
+                any(k == key for k, _ in slot[1])
+
+    def __getitem__(self, key):
+        h, slot = self._bucket(key)
+        if slot is not None and slot[0] == h:
+            for k, v in slot[1]:
+                if k == key:
+                    return v
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        h = hash(key) & hashMask
+        self.root = node = self._writable(self.root)
+        shift = 0
+        while True:
+            j = (h >> shift) & mask
+            slot = node[j]
+            if slot is None:
+                node[j] = (h, ((key, value),))
+                self.size += 1
+                return
+            if type(slot) is list:
+                child = self._writable(slot)
+            elif slot[0] == h:
+                pairs = tuple((k, v) for k, v in slot[1] if k != key)
+                if len(pairs) == len(slot[1]):
+                    self.size += 1
+                node[j] = (h, pairs + ((key, value),))
+                return
+            else:
+                # Another hash got here first, so both move a level down
+                child = self._node()
+                child[(slot[0] >> (shift + bits)) & mask] = slot
+            node[j] = child
+            node, shift = child, shift + bits
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        h = hash(key) & hashMask
+        self.root = node = self._writable(self.root)
+        shift = 0
+        while type(node[(h >> shift) & mask]) is list:
+            j = (h >> shift) & mask
+            child = self._writable(node[j])
+            node[j] = child
+            node, shift = child, shift + bits
+        j = (h >> shift) & mask
+        pairs = tuple((k, v) for k, v in node[j][1] if k != key)
+        node[j] = (h, pairs) if pairs else None
+        self.size -= 1
+
+    def iteritems(self):
+        return _items(self.root)
+
+    def iterkeys(self):
+        for key, _ in self.iteritems():
+            yield key
+
+    def itervalues(self):
+        for _, value in self.iteritems():
+            yield value
+
+    __iter__ = iterkeys
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def diff(self, other):
+        """ Yields the keys that are in only one of self and other, or have
+            different values """
+        stack = [(self.root, other.root)]
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            if type(a) is list and type(b) is list:
+                stack.extend(zip(a[:width], b[:width]))
+                continue
+            left, right = dict(_items(a)), dict(_items(b))
+            for key in set(left) | set(right):
+                if key not in left or key not in right or left[key] != right[key]:
+                    yield key
+
+###############################################################################
+# Bonds
+
+class PersistentBondBook(BondBook):
+    """ A BondBook kept in Dicts, with Dicts of bond counts inside. A count
+        Dict shared with a fork is forked itself before it is changed. """
+
+    def __init__(self, bonds=(), round=0):
+        self.owner = object()
+        BondBook.__init__(self, bonds, round)
+
+    def _table(self):
+        return Dict(owner=self.owner)
+
+    def _held(self, table, key):
+        held = table.get(key)
+        if held is None:
+            held = table[key] = self._table()
+        elif held.owner is not self.owner:
+            held = table[key] = held.fork(self.owner)
+        return held
+
+    def fork(self):
+        other = copy.copy(self)
+        other.owner, self.owner = object(), object()
+        other.touched = set()
+        for name in ("byPlayer", "byMaturity", "totals", "incomes", "groups"):
+            table = getattr(self, name)
+            setattr(other, name, table.fork(other.owner))
+            table.owner = self.owner
+        return other
@@ -0,0 +1,77 @@
+""" Counts and times the commands run in a game.
+
+A game only has a profiler when main.profile is set, and the code paths
+check for it once, so a game without one runs exactly as before. Times are
+kept as histograms with a bucket per power of two microseconds. Allocations
+are the growth in objects tracked by the garbage collector, which is turned
+off while a command is measured so that a collection doesn't reset the
+count. """
+
+import gc
+from timeit import default_timer as timer
+
+class Stat(object):
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.
+        self.longest = 0.
+        self.allocs = 0
+        self.buckets = {} # bucket -> calls taking less than 2**bucket us
+    def add(self, seconds, allocs):
+        self.calls += 1
+        self.total += seconds
+        self.longest = max(self.longest, seconds)
+        self.allocs += allocs
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+    def asDict(self):
+        return {"calls": self.calls, "total": self.total, "max": self.longest,
+                "allocs": self.allocs,
+                "histogram": dict(("<%dus" % 2**b, n) for b, n in self.buckets.items())}
+
+class Profiler(object):
+    def __init__(self):
+        self.stats = {} # key -> Stat
+
+    def record(self, key, seconds, allocs):
+        stat = self.stats.get(key)
+        if stat is None:
+            stat = self.stats[key] = Stat()
+        stat.add(seconds, allocs)
+
+    def call(self, key, f, *args):
+        """ Returns f(*args), recording its time and allocations under key """
+        enabled = gc.isenabled()
+        gc.disable()
+        count = gc.get_count()[0]
+        start = timer()
+        try:
+            return f(*args)
+        finally:
+            self.record(key, timer() - start, gc.get_count()[0] - count)
+            if enabled:
+                gc.enable()
+
+    def clock(self, sig):
+        """ Returns a function that records the time since it was last
+            called, or since the clock was made, as a phase of sig """
+        last = [timer(), gc.get_count()[0]]
+        def mark(phase):
+            self.record("%s/%s" % (sig, phase), timer() - last[0],
+                        gc.get_count()[0] - last[1])
+            last[:] = [timer(), gc.get_count()[0]]
+        return mark
+
+    def report(self):
+        lines = ["%-16s %8s %10s %10s %10s" % ("", "calls", "mean us", "max us", "allocs")]
+        for key in sorted(self.stats):
+            stat = self.stats[key]
+            lines.append("%-16s %8d %10.1f %10.1f %10.1f" % (key, stat.calls,
+                    stat.total / stat.calls * 1e6, stat.longest * 1e6,
+                    float(stat.allocs) / stat.calls))
+            lines.append("    " + " ".join("<%dus:%d" % (2**b, n)
+                    for b, n in sorted(stat.buckets.items())))
+        return lines
+
+    def asDict(self):
+        return dict((key, stat.asDict()) for key, stat in self.stats.items())
@@ -0,0 +1,223 @@
+""" A copy of the game state in shared memory, for screens showing the game.
+
+After every command that can change the game, main.execute publishes the
+state to a Replica: the gold, soldiers, bond total and bond income of every
+player, the map and the planned battles. Only what changed is packed again:
+the map when it is replaced, the bond totals and incomes of the players
+the bond book says were touched, and the gold and soldiers when they differ
+from the copies published last. For persistent games only the players that
+differ are packed again, and arrays are quick to pack whole. Viewers open
+the same file with a Reader, see viewer.py, and read it through a memory
+map, so they never talk to the process running the game, and it never
+waits for them. Keep the file in /dev/shm for it to live in memory only.
+
+The file starts with a header holding the version of the state and where
+the two slots it alternates between are. Version v is in slot v % 2, so
+publishing v+1 writes the other slot, then where it is, and bumps the
+version last. Slot v % 2 is only written again for v+2, after the version
+has moved past v, so a reader copies out slot v % 2 and keeps the copy if
+the version is still v afterwards, and otherwise tries again. A slot that
+has grown too small is moved to the end of the file, which never shrinks,
+as readers may still be reading the old one. """
+
+import mmap, os, struct
+
+import columns
+import persistent
+
+version = struct.Struct("<q")
+cell = struct.Struct("<q")
+slot = struct.Struct("<qq") # offset, capacity
+header = struct.Struct("<qqqqq")
+# players, round, inbattle, waterDiePercentage, map size, attacks, supports
+head = struct.Struct("<7q")
+
+def ints(values):
+    if columns.isArray(values):
+        return values.astype("<i8").tostring()
+    return struct.pack("<%dq" % len(values), *values)
+
+def packMap(links):
+    """ Returns the neighbour counts of a map followed by the neighbours """
+    lists = links.asLists()
+    return ints([len(cons) for cons in lists] + [q for cons in lists for q in cons])
+
+def pack(game, gold, soldiers, bonds, links):
+    """ Returns the state of game as a slot, with its columns packed already """
+    stacks = [x for pair in game.attackStack + game.supportStack for x in pair]
+    return "".join([
+        head.pack(game.players, game.bonds.round, int(game.inbattle),
+                  game.waterDiePercentage, len(game.links),
+                  len(game.attackStack), len(game.supportStack)),
+        gold, soldiers, bonds, links, ints(stacks)])
+
+class Replica(object):
+    """ Publishes the state of a game to the file at path, replacing any
+        state published there before """
+    def __init__(self, path):
+        # Viewers of an earlier game keep their old file until they notice
+        temp = path + ".new"
+        f = open(temp, "w+b")
+        f.write(header.pack(0, header.size, 0, header.size, 0))
+        f.flush()
+        self.map = mmap.mmap(f.fileno(), header.size)
+        f.close()
+        os.rename(temp, path)
+        self.version = 0
+        self.slots = [(header.size, 0), (header.size, 0)]
+        self.size = header.size
+        # Maps are replaced rather than changed, so the packed map is kept
+        # until the game gets another one
+        self.links = None
+        self.packedMap = None
+        # The totals followed by the incomes of the players of book
+        self.book = None
+        self.packedBonds = None
+        # name -> (copy of the column published last, packed)
+        self.published = {}
+
+    def _packColumn(self, name, values, n):
+        """ Returns the first n values packed. Undoing `sps` leaves the
+            columns longer than the players. """
+        if columns.isArray(values):
+            return ints(values[:n])
+        last, packed = self.published.get(name, (None, None))
+        if isinstance(values, persistent.Vector):
+            if last is None or len(last) != len(values) or len(packed) != 8*n:
+                packed = bytearray(ints([values[i] for i in xrange(n)]))
+            else:
+                for i in values.diff(last):
+                    if i < n:
+                        cell.pack_into(packed, 8*i, values[i])
+            self.published[name] = (values.fork(), packed)
+            return str(packed)
+        if len(values) != n:
+            values = values[:n]
+        if values != last:
+            packed = ints(values)
+            self.published[name] = (list(values), packed)
+        return packed
+
+    def _packBonds(self, game):
+        book, n = game.bonds, game.players
+        if book is not self.book or len(self.packedBonds) != 16*n:
+            self.book = book
+            self.packedBonds = bytearray(ints(map(book.total, range(n))) +
+                                         ints(map(book.income, range(n))))
+        else:
+            for p in book.touched:
+                if p < n:
+                    cell.pack_into(self.packedBonds, 8*p, book.total(p))
+                    cell.pack_into(self.packedBonds, 8*(n+p), book.income(p))
+        book.touched.clear()
+
+    def publish(self, game):
+        if game.links is not self.links:
+            self.links = game.links
+            self.packedMap = packMap(game.links)
+        self._packBonds(game)
+        data = pack(game, self._packColumn("gold", game.gold, game.players),
+                    self._packColumn("soldiers", game.soldiers, game.players),
+                    str(self.packedBonds), self.packedMap)
+        k = (self.version + 1) % 2
+        offset, capacity = self.slots[k]
+        if len(data) > capacity:
+            offset, capacity = self.size, 2*len(data)
+            self.size += capacity
+            self.map.resize(self.size)
+            self.slots[k] = (offset, capacity)
+        self.map[offset:offset+len(data)] = data
+        slot.pack_into(self.map, version.size + k*slot.size, offset, capacity)
+        self.version += 1
+        version.pack_into(self.map, 0, self.version)
+
+    def close(self):
+        self.map.close()
+
+class Snapshot(object):
+    """ The state of a game as a viewer sees it. The bonds and incomes are
+        each player's bond total and the interest it pays next round. """
+    def __init__(self, view, offset, v):
+        self.version = v
+        (self.players, self.round, inbattle, self.waterDiePercentage, size,
+         attacks, supports) = head.unpack_from(view, offset)
+        self.inbattle = bool(inbattle)
+        n = self.players
+        offset += head.size
+        values = struct.unpack_from("<%dq" % (4*n + size), view, offset)
+        self.gold, self.soldiers, self.bonds, self.incomes = \
+                [list(values[j*n:(j+1)*n]) for j in range(4)]
+        degrees = values[4*n:]
+        offset += 8 * len(values)
+        rest = struct.unpack_from("<%dq" % (sum(degrees) + 2*(attacks + supports)),
+                                  view, offset)
+        self.links, i = [], 0
+        for degree in degrees:
+            self.links.append(list(rest[i:i+degree]))
+            i += degree
+        pairs = zip(rest[i::2], rest[i+1::2])
+        self.attackStack = pairs[:attacks]
+        self.supportStack = pairs[attacks:]
+
+class Reader(object):
+    """ Reads the state published to the file at path """
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.inode = None
+
+    def _open(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        try:
+            f = open(self.path, "rb")
+        except IOError:
+            return False
+        try:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        return True
+
+    def _replaced(self):
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return False
+
+    def read(self, since=0):
+        """ Returns the latest state, or None if nothing newer than version
+            since has been published """
+        if self.map is None and not self._open():
+            return None
+        while True:
+            v = version.unpack_from(self.map, 0)[0]
+            if v == since and self._replaced():
+                # The game was restarted, and publishes from version 1 again
+                if not self._open():
+                    return None
+                since = 0
+                continue
+            if v == 0 or v == since:
+                return None
+            offset, capacity = slot.unpack_from(self.map, version.size + (v % 2)*slot.size)
+            if offset + capacity > len(self.map):
+                # The file has grown since it was mapped
+                self._open()
+                continue
+            try:
+                state = Snapshot(self.map, offset, v)
+            except struct.error:
+                # Torn by the writer, unless the version says otherwise
+                if version.unpack_from(self.map, 0)[0] == v:
+                    raise
+                continue
+            if version.unpack_from(self.map, 0)[0] == v:
+                return state
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
@@ -0,0 +1,126 @@
+#!/bin/env python
+
+""" Hosts many games in one process over a line based TCP protocol.
+
+Connect with e.g. `telnet localhost 8023`, pick a game with `join name` and
+give commands just like in main.py. Any number of sessions may join the same
+game. Everything runs in a single asyncore loop, so the commands of a game
+are applied one at a time without any threads or locks, and each game is
+journaled to its own file in gameDir, from which it is restored when it is
+joined after a restart. """
+
+import asyncore, asynchat, socket
+import os, re, signal, sys
+from StringIO import StringIO
+
+import main
+import events
+from journal import Journal
+
+port = 8023
+gameDir = "games"
+
+class GameServer(asyncore.dispatcher):
+    def __init__(self, port):
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(("", port))
+        self.listen(5)
+        self.games = {} # name -> (game, journal)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            Session(self, pair[0])
+
+    def open(self, name):
+        """ Returns the game called name, starting it if it isn't running """
+        if name not in self.games:
+            if not os.path.isdir(gameDir):
+                os.makedirs(gameDir)
+            path = os.path.join(gameDir, name + ".cmds")
+            game = main.Game()
+            journal = Journal(path, main.flushEvery, main.fsyncPolicy,
+                              main.compactEvery)
+            # Continue the game if it was played before
+            journal.restore(game, lambda cmd: main.execute(game, journal, cmd))
+            main.attach(game, path)
+            # Prints to the output captured for the session in run
+            game.events.subscribe(events.Printer())
+            self.games[name] = (game, journal)
+        return self.games[name]
+
+    def run(self, name, cmd):
+        """ Runs cmd in the game called name.
+            Returns the output of the command and whether it ends the session. """
+        game, journal = self.games[name]
+        out = StringIO()
+        stdout, sys.stdout = sys.stdout, out
+        try:
+            isdone = main.runSafely(game, journal, cmd)
+        finally:
+            sys.stdout = stdout
+        return out.getvalue(), isdone
+
+    def shutdown(self):
+        for game, journal in self.games.itervalues():
+            if journal.f is not None:
+                journal.close(game)
+            main.detach(game)
+        self.close()
+
+class Session(asynchat.async_chat):
+    def __init__(self, server, sock):
+        asynchat.async_chat.__init__(self, sock)
+        self.server = server
+        self.name = None
+        self.buffer = []
+        self.set_terminator("\n")
+        self.push("Welcome! Use `join name` to join or start the game called name.\n% ")
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        cmd = "".join(self.buffer).strip()
+        self.buffer = []
+        if cmd:
+            isdone = self.handle_cmd(cmd)
+            if isdone:
+                self.push("Well played!\n")
+                self.close_when_done()
+                return
+        self.push("% ")
+
+    def handle_cmd(self, cmd):
+        parts = cmd.split()
+        if parts[0] == "join":
+            if len(parts) != 2 or not re.match(r"^\w+$", parts[1]):
+                self.push("Error: Usage: `join name`, where name is letters, digits and _\n")
+            else:
+                self.name = parts[1]
+                self.server.open(self.name)
+                self.push("Info: Joined game %s\n" % self.name)
+            return False
+        if self.name is None:
+            self.push("Error: Use `join name` to join a game first.\n")
+            return False
+        output, isdone = self.server.run(self.name, cmd)
+        self.push(output)
+        return isdone
+
+###############################################################################
+# Run
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    server = GameServer(port)
+    print "Serving games on port %d" % port
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    try:
+        asyncore.loop()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    server.shutdown()
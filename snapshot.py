@@ -0,0 +1,92 @@
+""" A compact binary checkpoint of the full state of a game.
+
+The file starts with the magic bytes, the format version, the generation of
+the journal it was written with and the offset in the journal where the
+commands given after the checkpoint start, followed by the round the bonds
+are in. Then follow the fields of the game, with lists stored as a length
+and that many signed 64 bit integers, all little endian. """
+
+import struct
+
+import columns
+import persistent
+from bondbook import BondBook
+from gamemap import Map
+
+magic = "WGSN"
+version = 2
+
+class SnapshotError(Exception):
+    pass
+
+def _writeInts(f, values):
+    if columns.isArray(values):
+        values = values.tolist()
+    f.write(struct.pack("<q%dq" % len(values), len(values), *values))
+
+def _readInts(f):
+    n, = struct.unpack("<q", f.read(8))
+    return struct.unpack("<%dq" % n, f.read(8*n))
+
+def _pairs(values):
+    return zip(values[::2], values[1::2])
+
+def write(game, f, generation, offset):
+    f.write(struct.pack("<4sHqq", magic, version, generation, offset))
+    f.write(struct.pack("<q", game.bonds.round))
+    f.write(struct.pack("<qq?", game.players, game.waterDiePercentage, game.inbattle))
+    # The map as the number of links of each player followed by all links
+    links = game.links.asLists()
+    _writeInts(f, [len(cons) for cons in links])
+    _writeInts(f, [q for cons in links for q in cons])
+    _writeInts(f, game.gold)
+    _writeInts(f, game.soldiers)
+    # The bonds as columns
+    bonds = list(game.bonds)
+    for i in range(4):
+        _writeInts(f, [bond[i] for bond in bonds])
+    _writeInts(f, [p for pair in game.attackStack for p in pair])
+    _writeInts(f, [p for pair in game.supportStack for p in pair])
+
+def read(f):
+    """ Returns the generation, offset and the state stored in f """
+    head = f.read(struct.calcsize("<4sHqq"))
+    if len(head) < struct.calcsize("<4sHqq"):
+        raise SnapshotError("The checkpoint is truncated")
+    mark, v, generation, offset = struct.unpack("<4sHqq", head)
+    if mark != magic:
+        raise SnapshotError("Not a checkpoint file")
+    if v != version:
+        raise SnapshotError("Unsupported checkpoint version %d" % v)
+    try:
+        state = {}
+        state["round"], = struct.unpack("<q", f.read(8))
+        state["players"], state["waterDiePercentage"], state["inbattle"] = \
+                struct.unpack("<qq?", f.read(struct.calcsize("<qq?")))
+        counts, flat = _readInts(f), _readInts(f)
+        links, i = [], 0
+        for n in counts:
+            links.append(list(flat[i:i+n]))
+            i += n
+        state["links"] = Map(links)
+        state["gold"] = list(_readInts(f))
+        state["soldiers"] = list(_readInts(f))
+        state["bonds"] = zip(*[_readInts(f) for i in range(4)])
+        state["attackStack"] = _pairs(_readInts(f))
+        state["supportStack"] = _pairs(_readInts(f))
+    except (struct.error, ValueError), e:
+        raise SnapshotError("The checkpoint is truncated: %s" % e)
+    return generation, offset, state
+
+def apply(game, state):
+    """ Puts the state returned by read into game """
+    arrays = columns.isArray(game.gold)
+    shared = persistent.isPersistent(game)
+    for field in ("players", "waterDiePercentage", "inbattle", "links",
+                  "gold", "soldiers", "attackStack", "supportStack"):
+        setattr(game, field, state[field])
+    game.bonds = BondBook(state["bonds"], state["round"])
+    if arrays:
+        columns.useArrays(game)
+    elif shared:
+        persistent.usePersistent(game)
@@ -0,0 +1,35 @@
+import random, unittest
+
+import bench
+
+def supportLoops(cmds):
+    """ Returns the loops of at least two players supporting each other """
+    supports = {}
+    for cmd in cmds:
+        words = cmd.split()
+        if words[0] == "sup":
+            supports[int(words[1])] = int(words[2])
+    loops = set()
+    for start in supports:
+        seen, p = [], start
+        while p in supports and p not in seen:
+            seen.append(p)
+            p = supports[p]
+        if p in seen and len(seen) - seen.index(p) > 1:
+            loops.add(frozenset(seen[seen.index(p):]))
+    return loops
+
+class GeneratePlanTest(unittest.TestCase):
+    def testPlansContainSupportLoops(self):
+        for players in (10, 100, 1000):
+            for seed in range(5):
+                cmds = bench.generatePlan(random.Random(seed), players)
+                self.assertTrue(supportLoops(cmds), (players, seed))
+
+    def testEveryPlayerIsPlannedOnce(self):
+        cmds = bench.generatePlan(random.Random(1), 100)
+        planned = [int(cmd.split()[1]) for cmd in cmds[1:]]
+        self.assertEqual(sorted(planned), range(100))
+
+if __name__ == "__main__":
+    unittest.main()
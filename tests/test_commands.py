@@ -0,0 +1,42 @@
+import unittest
+
+import main
+import commands
+from journal import NullJournal
+
+class ArgumentShapeTest(unittest.TestCase):
+    def setUp(self):
+        self.game = main.Game()
+        self.journal = NullJournal()
+        for line in ["sps 2", "sbs 1 [[10, 2, 5]]"]:
+            main.execute(self.game, self.journal, line)
+
+    def assertRejected(self, line):
+        parts = line.split()
+        Cmd = commands.registry[parts[0]]
+        self.assertRaises(ValueError, commands.parseArgs, self.game, Cmd, parts[1:])
+        bonds, links = list(self.game.bonds), self.game.links.asLists()
+        undo = len(self.game.undoStack)
+        main.execute(self.game, self.journal, line)
+        self.assertEqual(list(self.game.bonds), bonds)
+        self.assertEqual(self.game.links.asLists(), links)
+        self.assertEqual(len(self.game.undoStack), undo)
+
+    def testBondsMustBeTriplesOfIntegers(self):
+        for bonds in ['[[10,2,"x"]]', '[[1,2]]', '5', '[5]', '[[1,2,3,4]]',
+                      '[[1.5,2,3]]', '[[true,2,3]]', '{"a": 1}', '[[1,2,3],[4]]']:
+            self.assertRejected("sbs 1 %s" % bonds)
+
+    def testMapMustBeListsOfIntegers(self):
+        for links in ['5', '[1,2]', '[[1],"x"]', '[[1.0],[0]]', '[[null],[0]]',
+                      '{"0": [1]}']:
+            self.assertRejected("sma %s" % links)
+
+    def testWellFormedArgumentsAreAccepted(self):
+        main.execute(self.game, self.journal, "sbs 0 [[4, 1, 2], [6, 3, 5]]")
+        main.execute(self.game, self.journal, "sma [[1], [0]]")
+        self.assertEqual(self.game.bonds.of(0), [(0, 4, 1, 2), (0, 6, 3, 5)])
+        self.assertEqual(self.game.links.asLists(), [[1], [0]])
+
+if __name__ == "__main__":
+    unittest.main()
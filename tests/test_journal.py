@@ -0,0 +1,52 @@
+import os, shutil, sys, tempfile, unittest
+from StringIO import StringIO
+
+import main
+import commands
+from journal import Journal
+
+class BreakCommand(commands.Command):
+    """ Leaves gold that can't be stored, then fails """
+    sig = "break"
+    def run(self, game):
+        game.gold[0] = "x"
+        raise RuntimeError("failed partway")
+
+class FailedCompactionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "game.cmds")
+        commands.registry["break"] = BreakCommand
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        del commands.registry["break"]
+        shutil.rmtree(self.dir)
+
+    def restored(self):
+        game = main.Game()
+        journal = Journal(self.path)
+        journal.restore(game, lambda cmd: main.execute(game, journal, cmd))
+        return game
+
+    def testSessionSurvivesAFailedCompaction(self):
+        game, journal = main.Game(), Journal(self.path)
+        for line in ["sps 2", "sag 10", "sgo 1 7"]:
+            self.assertFalse(main.runSafely(game, journal, line))
+        before = open(self.path).read()
+        self.assertFalse(main.runSafely(game, journal, "break"))
+        self.assertIn("RuntimeError: failed partway", sys.stdout.getvalue())
+        self.assertIn("Error: Couldn't save the game", sys.stdout.getvalue())
+        # The last good journal and checkpoint are kept, with no leftovers
+        self.assertEqual(open(self.path).read(), before)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["game.cmds", "game.snap"])
+        self.assertEqual(list(self.restored().gold), [10, 7])
+        # and the session goes on
+        game.gold[0] = 10
+        self.assertFalse(main.runSafely(game, journal, "sgo 1 3"))
+        journal.close(game)
+        self.assertEqual(list(self.restored().gold), [10, 3])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/bin/env python
+
+""" Plays many headless games to see how the game parameters play out.
+
+Usage: tournament.py [games per setting] [processes]
+
+Every combination of the values in grid is a setting, and each setting is
+played the given number of times, spread over a pool of processes. The
+players follow one of the policies below, picked at random. Every game is
+seeded by the seed, its setting and its number, and the results are summed
+up in the order the games were listed, so a run gives the same statistics
+however many processes play it. Nothing is written to disk. """
+
+import itertools, json, multiprocessing, random, sys
+
+import main
+import events
+from journal import NullJournal
+from undolog import UndoLog
+
+players = 12
+rounds = 20
+startGold = 100
+startSoldiers = 20
+seed = 1
+grid = {
+    "waterDiePercentage": [0, 10, 30],
+    # The (lockedRounds, rate) pairs bonds can be bought with
+    "bondTerms": [((1, 2), (3, 5)), ((2, 5), (5, 15))],
+}
+
+###############################################################################
+# Policies
+#
+# Each gets the game, a random generator, the player and the bond terms, and
+# returns the command lines the player gives before the battle, and the
+# command lines planning the battle.
+
+def randomPolicy(game, rnd, p, terms):
+    """ Buys, invests or retracts a random amount, and attacks or supports
+        a random player """
+    economy, battle = [], []
+    gold, bonds = game.gold[p], game.bonds.total(p)
+    r = rnd.random()
+    if gold and r < 0.3:
+        economy.append("buy %d %d" % (p, rnd.randint(1, gold)))
+    elif gold and r < 0.6:
+        k, y = rnd.choice(terms)
+        economy.append("inv %d %d %d %d" % (p, rnd.randint(1, gold), k, y))
+    elif bonds and r < 0.7:
+        economy.append("ret %d %d 0" % (p, rnd.randint(1, bonds)))
+    other = rnd.randrange(game.players)
+    if other != p and game.soldiers[p]:
+        battle.append("%s %d %d" % (rnd.choice(["att", "sup"]), p, other))
+    return economy, battle
+
+def saverPolicy(game, rnd, p, terms):
+    """ Puts all gold in bonds on the longest terms, and never fights """
+    k, y = max(terms)
+    if game.gold[p]:
+        return ["inv %d %d %d %d" % (p, game.gold[p], k, y)], []
+    return [], []
+
+def raiderPolicy(game, rnd, p, terms):
+    """ Spends all gold on soldiers and attacks the richest neighbour """
+    economy, battle = [], []
+    if game.gold[p]:
+        economy.append("buy %d %d" % (p, game.gold[p]))
+    targets = sorted(game.links[p], key=lambda q: -(game.gold[q] + game.bonds.total(q)))
+    if targets and game.soldiers[p] + game.gold[p]:
+        battle.append("att %d %d" % (p, targets[0]))
+    return economy, battle
+
+def allyPolicy(game, rnd, p, terms):
+    """ Invests half its gold, and supports its strongest neighbour """
+    economy, battle = [], []
+    k, y = min(terms)
+    if game.gold[p] > 1:
+        economy.append("inv %d %d %d %d" % (p, game.gold[p] // 2, k, y))
+    allies = sorted(game.links[p], key=lambda q: -game.soldiers[q])
+    if allies and game.soldiers[p]:
+        battle.append("sup %d %d" % (p, allies[0]))
+    return economy, battle
+
+policies = {"random": randomPolicy, "saver": saverPolicy,
+            "raider": raiderPolicy, "ally": allyPolicy}
+
+###############################################################################
+# Playing
+
+def setup(rnd, setting):
+    """ Returns the commands starting a game with a random connected map """
+    links = [set([(p+1) % players, (p-1) % players]) for p in range(players)]
+    for _ in range(players // 2):
+        p, q = rnd.sample(range(players), 2)
+        links[p].add(q)
+        links[q].add(p)
+    cmds = ["sps %d" % players, "sma %s" % json.dumps([sorted(l) for l in links]),
+            "sag %d" % startGold, "swd %d" % setting["waterDiePercentage"]]
+    cmds.extend("sss %d %d" % (p, startSoldiers) for p in range(players))
+    return cmds
+
+class Tally(object):
+    """ Counts the battles of a game from its events """
+    kinds = (events.Casualties,)
+    def __init__(self):
+        self.battles = 0
+        self.casualties = 0
+    def __call__(self, event):
+        if isinstance(event, events.Casualties):
+            self.battles += 1
+            self.casualties += 2 * event.soldiers
+
+def play((number, setting)):
+    """ Plays a game with the setting. Returns the policy and final worth of
+        each player, and the battles fought. """
+    rnd = random.Random("%d %s %d" % (seed, sorted(setting.items()), number))
+    game = main.Game()
+    # Nothing is undone, and spilling undo history to disk would write files
+    game.undoStack = UndoLog()
+    journal = NullJournal()
+    tally = Tally()
+    game.events.subscribe(tally)
+    for cmd in setup(rnd, setting):
+        main.execute(game, journal, cmd)
+    names = [rnd.choice(sorted(policies)) for p in range(players)]
+    terms = setting["bondTerms"]
+    for _ in range(rounds):
+        plans = [policies[names[p]](game, rnd, p, terms) for p in range(players)]
+        for economy, _ in plans:
+            for cmd in economy:
+                main.execute(game, journal, cmd)
+        main.execute(game, journal, "nba")
+        for _, battle in plans:
+            for cmd in battle:
+                main.execute(game, journal, cmd)
+        main.execute(game, journal, "rba")
+        main.execute(game, journal, "rec")
+    worth = [int(game.gold[p] + game.bonds.total(p)) for p in range(players)]
+    return names, worth, tally.battles, tally.casualties
+
+###############################################################################
+# Statistics
+
+def gini(values):
+    values = sorted(values)
+    total = sum(values)
+    if not total:
+        return 0.
+    weighted = sum((i+1) * v for i, v in enumerate(values))
+    return 2. * weighted / (len(values) * total) - (len(values) + 1.) / len(values)
+
+def summarize(setting, results):
+    worths = [w for _, worth, _, _ in results for w in worth]
+    byPolicy, wins = {}, dict((name, 0) for name in policies)
+    for names, worth, _, _ in results:
+        for name, w in zip(names, worth):
+            byPolicy.setdefault(name, []).append(w)
+        wins[names[worth.index(max(worth))]] += 1
+    worths.sort()
+    return {"setting": setting,
+            "games": len(results),
+            "meanWorth": float(sum(worths)) / len(worths),
+            "medianWorth": worths[len(worths) // 2],
+            "gini": sum(gini(worth) for _, worth, _, _ in results) / len(results),
+            "battlesPerRound": sum(b for _, _, b, _ in results) / float(len(results) * rounds),
+            "casualtiesPerGame": sum(c for _, _, _, c in results) / float(len(results)),
+            "bankruptcyRate": sum(1 for w in worths if w == 0) / float(len(worths)),
+            "meanWorthByPolicy": dict((name, sum(ws) / float(len(ws)))
+                                      for name, ws in byPolicy.items()),
+            "winsByPolicy": wins}
+
+def tournament(games, processes=None):
+    """ Plays games games of every setting in grid. Returns a summary of
+        each setting. """
+    keys = sorted(grid)
+    settings = [dict(zip(keys, values))
+                for values in itertools.product(*[grid[k] for k in keys])]
+    tasks = [(number, setting) for setting in settings for number in range(games)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(play, tasks, chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
+    return [summarize(setting, results[i*games:(i+1)*games])
+            for i, setting in enumerate(settings)]
+
+###############################################################################
+# Run
+
+if __name__ == "__main__":
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    for summary in tournament(games, processes):
+        print "%s:" % ", ".join("%s %s" % item for item in sorted(summary["setting"].items()))
+        print "    worth mean %.1f, median %d, gini %.3f, bankrupt %.1f%%" % (
+                summary["meanWorth"], summary["medianWorth"], summary["gini"],
+                100 * summary["bankruptcyRate"])
+        print "    %.2f battles a round, %.1f casualties a game" % (
+                summary["battlesPerRound"], summary["casualtiesPerGame"])
+        print "    by policy: %s" % ", ".join("%s worth %.1f won %d" % (name,
+                summary["meanWorthByPolicy"].get(name, 0), summary["winsByPolicy"][name])
+                for name in sorted(policies))
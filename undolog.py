@@ -0,0 +1,53 @@
+""" The stack of commands that can be undone.
+
+Only the newest commands are kept in memory. When there are more than depth
+of them, the older half is pickled, compressed and appended to a temporary
+spill file as one segment, and when undo gets that far back, the last
+segment is read back and cut off the file. So the memory used stays flat
+however long the game runs, while every command can still be undone. """
+
+import cPickle as pickle
+import tempfile
+import zlib
+
+class UndoLog(object):
+    def __init__(self, depth=None):
+        self.depth = depth # None keeps everything in memory
+        self.recent = []
+        self.segments = [] # (offset, size, count) in the spill file
+        self.spilled = 0
+        self.f = None
+
+    def __len__(self):
+        return self.spilled + len(self.recent)
+
+    def append(self, inst):
+        self.recent.append(inst)
+        if self.depth is not None and len(self.recent) > self.depth:
+            self.spill(len(self.recent) // 2)
+
+    def pop(self):
+        if not self.recent and self.segments:
+            self.load()
+        if not self.recent:
+            raise IndexError("Nothing to undo")
+        return self.recent.pop()
+
+    def spill(self, n):
+        """ Moves the n oldest commands in memory to the spill file """
+        if self.f is None:
+            self.f = tempfile.TemporaryFile()
+        data = zlib.compress(pickle.dumps(self.recent[:n], pickle.HIGHEST_PROTOCOL))
+        self.f.seek(0, 2)
+        self.segments.append((self.f.tell(), len(data), n))
+        self.f.write(data)
+        self.spilled += n
+        del self.recent[:n]
+
+    def load(self):
+        """ Moves the newest segment of the spill file back into memory """
+        offset, size, n = self.segments.pop()
+        self.f.seek(offset)
+        self.recent[:0] = pickle.loads(zlib.decompress(self.f.read(size)))
+        self.f.truncate(offset)
+        self.spilled -= n
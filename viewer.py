@@ -0,0 +1,77 @@
+#!/bin/env python
+
+""" Shows a game on a screen of its own, as it is played.
+
+Usage: viewer.py [-s] [-i seconds] [name]
+
+Reads the state the game called name publishes to main.replicaDir, by
+default the game of main.py, and redraws the report of `print`, or of
+`standings` with -s, whenever it changes. The state is checked every 0.1
+seconds, or as often as -i says. Any number of viewers can watch a game, and
+none of them slows it down, see replica.py. """
+
+import getopt, os, sys, time
+
+import main
+from replica import Reader
+
+clear = "\033[H\033[2J"
+
+def report(state):
+    lines = ["==========", "Round %d, version %d" % (state.round, state.version)]
+    lines.append("The map has the connections: %s" % (state.links,))
+    lines.append("Economy:")
+    for p in range(state.players):
+        lines.append("    Player %d has %d gold and %d soldiers" % (p, state.gold[p], state.soldiers[p]))
+        lines.append("    His/her bonds are worth %d, paying %d next round" % (state.bonds[p], state.incomes[p]))
+    if state.inbattle:
+        lines.append("Currently on the supportStack:")
+        lines.append("    " + " ".join(map(repr, state.supportStack)))
+        lines.append("Currently on the attackStack:")
+        lines.append("    " + " ".join(map(repr, state.attackStack)))
+    else:
+        lines.append("No battles are currently being planned")
+    lines.append("==========")
+    return "\n".join(lines)
+
+def standings(state):
+    worth = [state.gold[p] + state.bonds[p] for p in range(state.players)]
+    lines = ["==========", "Standings after round %d:" % state.round]
+    for rank, p in enumerate(sorted(range(state.players), key=lambda p: -worth[p])):
+        lines.append("    %d. Player %d is worth %d: %d gold and %d in bonds paying %d next round"
+                     % (rank+1, p, worth[p], state.gold[p], state.bonds[p], state.incomes[p]))
+    lines.append("==========")
+    return "\n".join(lines)
+
+def watch(reader, render, interval):
+    shown = 0
+    while True:
+        state = reader.read(shown)
+        if state is not None:
+            sys.stdout.write(clear + render(state) + "\n")
+            sys.stdout.flush()
+            shown = state.version
+        time.sleep(interval)
+
+###############################################################################
+# Run
+
+if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "si:")
+    except getopt.GetoptError, e:
+        print >> sys.stderr, "Error: %s" % e
+        print >> sys.stderr, "Usage: viewer.py [-s] [-i seconds] [name]"
+        sys.exit(2)
+    opts = dict(opts)
+    if not main.replicaDir:
+        print >> sys.stderr, "Error: Set replicaDir in main.py to publish the game"
+        sys.exit(1)
+    name = args[0] if args else os.path.splitext(os.path.basename(main.backup))[0]
+    reader = Reader(main.replicaPath(name))
+    try:
+        watch(reader, standings if "-s" in opts else report,
+              float(opts.get("-i", 0.1)))
+    except KeyboardInterrupt:
+        pass
+    reader.close()
@@ -0,0 +1,105 @@
+""" Tries out alternative battle plans without touching the game.
+
+A plan is a list of `att` and `sup` command lines, added to whatever battle
+is being planned. Every plan is run on its own copy of the game, followed by
+`rba`, and the events of the battle are summed up into a result. The copy
+is made from a binary checkpoint of the game, or by forking it if the game
+is persistent. The plans are spread over a pool of processes, which are
+forked, so the live game is shared with them and only the plans and results
+are sent between processes. """
+
+import copy
+import multiprocessing
+from StringIO import StringIO
+
+import commands
+import events
+import persistent
+import snapshot
+from undolog import UndoLog
+
+# Processes to use, None for one per core
+processes = None
+
+def checkpoint(game):
+    """ Returns what fork needs to copy game """
+    if persistent.isPersistent(game):
+        return None
+    f = StringIO()
+    snapshot.write(game, f, 0, 0)
+    return f.getvalue()
+
+def fork(game, data):
+    """ Returns a copy of game with the state in the checkpoint data,
+        without subscribers or anything to undo. Persistent games have no
+        checkpoint, as forking them is cheaper. """
+    if data is None:
+        return persistent.fork(game)
+    other = copy.copy(game)
+    other.events = events.EventBus()
+    other.undoStack = UndoLog()
+    other.profiler = None
+    other.replica = None
+    snapshot.apply(other, snapshot.read(StringIO(data))[2])
+    return other
+
+def run(game, line):
+    parts = line.split()
+    Cmd = parts and commands.registry.get(parts[0])
+    if Cmd not in (commands.AttackCommand, commands.SupportCommand):
+        raise ValueError("Plans can only have `att` and `sup` lines, not '%s'" % line)
+    Cmd().run(game, *commands.parseArgs(game, Cmd, parts[1:]))
+
+def resolve(game, data, plan):
+    """ Returns what happens if the battle is run with the plan added """
+    game = fork(game, data)
+    happened = []
+    game.events.subscribe(happened.append)
+    result = {"plan": plan, "errors": [], "battles": 0, "casualties": 0,
+              "gold": 0, "winners": []}
+    if not game.inbattle:
+        commands.NewBattleCommand().run(game)
+    for line in plan:
+        try:
+            run(game, line)
+        except ValueError, e:
+            commands.error(game, str(e))
+    commands.RunBattleCommand().run(game)
+    for event in happened:
+        if isinstance(event, events.ValidationError):
+            result["errors"].append(event.message)
+        elif isinstance(event, events.WaterLoss):
+            result["casualties"] += event.soldiers
+        elif isinstance(event, events.Casualties):
+            result["battles"] += 1
+            result["casualties"] += 2 * event.soldiers
+        elif isinstance(event, events.GoldStolen):
+            result["gold"] += event.amount
+        elif isinstance(event, events.BattleResult) and event.outcome != "drew":
+            result["winners"].append(event.attackers if event.outcome == "won"
+                                     else event.defenders)
+    return result
+
+# The game and checkpoint the processes of the pool were forked with
+shared = None
+
+def share(game, data):
+    global shared
+    shared = (game, data)
+
+def resolveShared(plan):
+    return resolve(shared[0], shared[1], plan)
+
+def evaluate(game, plans):
+    """ Returns the result of each of plans, in the same order """
+    data = checkpoint(game)
+    # No more processes than plans, and none at all to run a single one
+    n = min(len(plans), processes or multiprocessing.cpu_count())
+    if n <= 1:
+        return [resolve(game, data, plan) for plan in plans]
+    pool = multiprocessing.Pool(n, share, (game, data))
+    try:
+        return pool.map(resolveShared, plans)
+    finally:
+        pool.close()
+        pool.join()